@@ -15,12 +15,56 @@ import collections
 import matplotlib.pyplot as plt
 import time
 import scipy.signal
+import multiprocessing
+import Queue
+import gridSearchPlanner
+import instrumentation
+import gridSearchJournal
+import resultsStore
+
+# Called with (directory, parameters, synchronized score, unsynchronized score) for each test as soon as
+# it's run, so progress doesn't wait for whole directories.  In worker processes, this sends the
+# results to the main process's queue.
+reportProgress = None
+
+def initializeWorker( progressQueue ):
+  global reportProgress
+  reportProgress = progressQueue.put
+
+# Run the tests for one directory whose parameters are in testParameters, skipping the stages only
+# the other tests need.  Each test's result is reported as soon as it's run.  Returns the work unit's
+# index and the instrumentation totals for the directory.  ODFs and windows are passed by name so that
+# work units can be sent to other processes.
+def runDirectory( indexedWorkUnit ):
+  unitIndex, (directory, testParameters, filenames, ODFNames, downsamplingFactors, frameSizes, hopSizeScales, windowNames, offsets, dtypeName) = indexedWorkUnit
+  testKeys = set( [gridSearchJournal.getKey( directory, parameters ) for parameters in testParameters] )
+  instrumentation.resetStats()
+  # Synchronized pair, then unsynchronized pair
+  plan = gridSearchPlanner.getPlan( directory, filenames, [(0, 1), (2, 3)], ODFNames, downsamplingFactors, frameSizes, hopSizeScales, windowNames, offsets, np.dtype( dtypeName ).type )
+  plan = gridSearchPlanner.prunePlan( plan, set( [parameters[:-1] for parameters in testParameters] ) )
+  for stage, (synchronizedScores, unsynchronizedScores) in gridSearchPlanner.executePlan( plan ):
+    for offset, synchronizedScore, unsynchronizedScore in zip( offsets, synchronizedScores, unsynchronizedScores ):
+      if gridSearchJournal.getKey( directory, stage.parameters + (offset,) ) in testKeys:
+        reportProgress( (directory, stage.parameters + (offset,), synchronizedScore, unsynchronizedScore) )
+  return unitIndex, instrumentation.getStats()
 
 if __name__ == "__main__":
   if len(sys.argv) < 3:
-    print "Usage: %s datasetDirectory csvFileName.csv" % sys.argv[0]
+    print "Usage: %s datasetDirectory csvFileName.csv [nWorkers] [double|single]" % sys.argv[0]
     sys.exit(-1)
   
+  # Number of processes to run tests in
+  if len(sys.argv) > 3:
+    nWorkers = int(sys.argv[3])
+  else:
+    nWorkers = multiprocessing.cpu_count()
+  
+  # Precision to run the analysis in - single precision halves the memory used
+  if len(sys.argv) > 4 and sys.argv[4] == 'single':
+    dtypeName = 'float32'
+  else:
+    dtypeName = 'float64'
+  
   ''' Everything 
   ODFs = [onsetDetection.ODF.HFCMasri,\
           onsetDetection.ODF.HFCJensen,\
@@ -42,6 +86,7 @@ if __name__ == "__main__":
           onsetDetection.ODF.HFCMasriBello,\
           onsetDetection.ODF.spectralDistance,\
           onsetDetection.ODF.complex,\
+          onsetDetection.ODF.phase,\
           onsetDetection.ODF.KLDivergence,\
           onsetDetection.ODF.melDifference]
   downsamplingFactors = np.array([1, 2, 4, 5])
@@ -58,60 +103,114 @@ if __name__ == "__main__":
   windows = [np.ones]
   offsets = np.array([2])
     
-  # Get subdirectories for the input folder, corresponding to different MIDI files
-  directories = [os.path.join( sys.argv[1], folder ) for folder in os.listdir(sys.argv[1]) if os.path.isdir(os.path.join(sys.argv[1], folder)) and folder[0] is not '.']
+  # Get subdirectories for the input folder, corresponding to different MIDI files.  MIDI files in the
+  # input folder are used directly, with their test files synthesized in process.
+  directories = [os.path.join( sys.argv[1], folder ) for folder in os.listdir(sys.argv[1]) if (os.path.isdir(os.path.join(sys.argv[1], folder)) or os.path.splitext( folder )[1].lower() in ('.mid', '.midi')) and folder[0] is not '.']
   
   # The variations on the MIDI files
   filenames = ['0-0ms.wav', '1-0ms.wav', '0-50ms.wav', '1-50ms.wav']
   
+  # Results are journaled as they arrive, so an interrupted grid search can be resumed
+  journalFilename = sys.argv[2] + '.journal'
+  journalResults = gridSearchJournal.readJournal( journalFilename )
+  
+  # The parameters of each test run on a directory, in the order they're run
+  gridSearchPlannerArguments = (filenames, [(0, 1), (2, 3)], [ODF.__name__ for ODF in ODFs], downsamplingFactors, frameSizes, hopSizeScales, [window.__name__ for window in windows], offsets)
+  plan = gridSearchPlanner.getPlan( '', *gridSearchPlannerArguments )
+  testParameters = [stage.parameters + (offset,) for stage in plan if stage.name == 'score' for offset in offsets]
+  # Only run the tests whose results aren't in the journal
+  remainingTests = collections.OrderedDict()
+  for directory in directories:
+    missingParameters = [parameters for parameters in testParameters if gridSearchJournal.getKey( directory, parameters ) not in journalResults]
+    if len( missingParameters ) > 0:
+      remainingTests[directory] = missingParameters
+  remainingDirectories = remainingTests.keys()
+  print "{} of {} directories already done according to {}".format( len( directories ) - len( remainingDirectories ), len( directories ), journalFilename )
+  
   # Calculate number of tests about to be run
-  nTests = np.product( [len(dimension) for dimension in (directories, ODFs, downsamplingFactors, frameSizes, hopSizeScales, windows, offsets)] )
+  nTests = sum( [len( missingParameters ) for missingParameters in remainingTests.values()] )
   print "About to run " + str( nTests ) + " tests."
+  # Report how much work planning the stages saves over running each test from scratch
+  naiveCounts = gridSearchPlanner.getNaiveStageCounts( *gridSearchPlannerArguments )
+  plannedCounts = gridSearchPlanner.getStageCounts( plan )
+  gridSearchPlanner.printSavings( naiveCounts, plannedCounts, len( remainingDirectories ) )
   # Keep track of which test is being run
-  testNumber = 0
+  progress = {'testNumber': 0}
   
   startTime = time.time()
   
+  # Results are journaled as each test is reported, so a crash only loses the tests still running
+  journal = gridSearchJournal.openJournal( journalFilename )
+  
+  # Journal and print each test's result as it's reported
+  def printProgress( (directory, parameters, synchronizedScore, unsynchronizedScore) ):
+    gridSearchJournal.writeResult( journal, directory, parameters, synchronizedScore, unsynchronizedScore )
+    journalResults[gridSearchJournal.getKey( directory, parameters )] = (synchronizedScore, unsynchronizedScore)
+    progress['testNumber'] += 1
+    testNumber = progress['testNumber']
+    # Estimate the time remaining from the rate at which all workers have been finishing tests
+    elapsedTime = time.time() - startTime
+    remainingTime = elapsedTime*(nTests - testNumber)/testNumber
+    print "{} -> {}/{} = {}, {:.3f}% done in {:.3f} minutes, {:.3f} minutes remaining".format( (directory,) + parameters, synchronizedScore, unsynchronizedScore, np.log( synchronizedScore/(unsynchronizedScore + 1e-10) + 1e-10 ), (100.0*testNumber)/nTests, elapsedTime/60.0, remainingTime/60.0 )
+  
   # Store the parameters corresponding to each result
   gridSearchResults = collections.defaultdict(list)
 
-  # The data, being manipulated each step of the way
-  audioData = {}
-  audioDataDownsampled = {}
-  spectrograms = {}
-  ODFOutput = {}
-  
-  # Test to plot histograms
-  allAccuracies = np.zeros( nTests )
-  
-  # Can we calculate the spectrogram from the previous spectrogram?
-  previousHopSizeScale = 0
-  
+  # Each directory is a separate work unit, with the tests it still needs
+  workUnits = [(directory, remainingTests[directory], filenames, [ODF.__name__ for ODF in ODFs], downsamplingFactors, frameSizes, hopSizeScales, [window.__name__ for window in windows], offsets, dtypeName) for directory in remainingDirectories]
+  if nWorkers > 1:
+    progressQueue = multiprocessing.Queue()
+    pool = multiprocessing.Pool( nWorkers, initializeWorker, (progressQueue,) )
+    unitResults = pool.imap_unordered( runDirectory, enumerate( workUnits ) )
+  else:
+    reportProgress = printProgress
+    unitResults = itertools.imap( runDirectory, enumerate( workUnits ) )
+
+  # Instrumentation totals over all of the workers
+  totalStats = {}
+  for n in xrange( len( workUnits ) ):
+    if nWorkers > 1:
+      # Print the tests the workers report while waiting for the next directory to finish
+      unitResult = None
+      while unitResult is None:
+        try:
+          unitResult = unitResults.next( timeout=0.5 )
+        except multiprocessing.TimeoutError:
+          pass
+        try:
+          while True:
+            printProgress( progressQueue.get_nowait() )
+        except Queue.Empty:
+          pass
+      unitIndex, stats = unitResult
+    else:
+      unitIndex, stats = unitResults.next()
+    instrumentation.mergeStats( totalStats, stats )
+    # Make sure the results of each finished directory are on disk
+    gridSearchJournal.syncJournal( journal )
+  if nWorkers > 1:
+    # Every test is reported before its directory's work unit is returned, but the reports may still
+    # be on their way
+    while progress['testNumber'] < nTests:
+      printProgress( progressQueue.get() )
+    pool.close()
+    pool.join()
+  gridSearchJournal.syncJournal( journal )
+  journal.close()
+  if instrumentation.isEnabled():
+    instrumentation.printSummary( totalStats )
+
+  # Merge results from the journal in directory order, so the output doesn't depend on which worker
+  # finished first or whether the results came from an earlier run
   for directory in directories:
-    # Read in wav data for each file - should try downsampling factors
-    for file in filenames: audioData[file], fs = utility.getWavData( os.path.join( directory, file ) )
-    for downsamplingFactor in downsamplingFactors:
-      for file in filenames: audioDataDownsampled[file] = scipy.signal.decimate( audioData[file], downsamplingFactor )
-      for frameSize, window, hopSizeScale in itertools.product( frameSizes, windows, hopSizeScales ):
-        if hopSizeScale < previousHopSizeScale and np.mod( previousHopSizeScale, hopSizeScale ) == 0:
-          # Instead of calculating a new spectrogram, just grab the frames
-          newHopRatio = previousHopSizeScale/hopSizeScale
-          for file in filenames: spectrograms[file] = spectrograms[file][::newHopRatio]
-        else:
-          # Calculate spectrograms - should not re-calculate if just the hop size changes.
-          for file in filenames: spectrograms[file] = utility.getSpectrogram( audioDataDownsampled[file], hop=frameSize/hopSizeScale, frameSize=frameSize, window=window( frameSize ) )
-        previousHopSizeScale = hopSizeScale
-        for ODF in ODFs:
-          # Get the onset detection function
-          for file in filenames: ODFOutput[file] = onsetDetection.ODF( spectrograms[file], ODF, fs=fs/downsamplingFactor ).onsetDetectionFunction
-          for offset in offsets:
-            # Compute the synchronization score for the syncrhonized and unsynchronized files
-            synchronizedScore = synchronizationScore.getScore( ODFOutput[filenames[0]], ODFOutput[filenames[1]], offset=offset )
-            unsynchronizedScore = synchronizationScore.getScore( ODFOutput[filenames[2]], ODFOutput[filenames[3]], offset=offset )
-            # Add in the ratio of the scores, we will take the per-MIDI-file-average later.
-            print "{} -> {}/{} = {}, {:.3f}% done in {:.3f} minutes".format( (directory, ODF.__name__, downsamplingFactor, frameSize, hopSizeScale, window.__name__, offset), synchronizedScore, unsynchronizedScore, np.log( synchronizedScore/(unsynchronizedScore + 1e-10) + 1e-10 ), (100.0*testNumber)/nTests, (time.time() - startTime)/60.0)
-            testNumber += 1
-            gridSearchResults[(ODF.__name__, downsamplingFactor, frameSize, hopSizeScale, window.__name__, offset)] += [np.log( synchronizedScore/(unsynchronizedScore + 1e-10) + 1e-10 )]
+    for parameters in testParameters:
+      synchronizedScore, unsynchronizedScore = journalResults[gridSearchJournal.getKey( directory, parameters )]
+      # Add in the ratio of the scores, we will take the per-MIDI-file-average later.
+      gridSearchResults[parameters] += [np.log( synchronizedScore/(unsynchronizedScore + 1e-10) + 1e-10 )]
+  
+  # Write out the raw scores for each directory as a columnar store, for gridSearchResultsAnalyzer
+  scores = np.array( [[journalResults[gridSearchJournal.getKey( directory, parameters )] for directory in directories] for parameters in testParameters] )
+  resultsStore.writeResults( os.path.splitext( sys.argv[2] )[0] + '.npz', testParameters, directories, synchronizedScores=scores[..., 0], unsynchronizedScores=scores[..., 1] )
   
   # Write out CSV results
   csvWriter = csv.writer( open( sys.argv[2], 'wb' ) )
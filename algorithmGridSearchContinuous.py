@@ -15,12 +15,21 @@ import collections
 import matplotlib.pyplot as plt
 import time
 import scipy.signal
+import gridSearchPlanner
+import instrumentation
+import resultsStore
 
 if __name__ == "__main__":
   if len(sys.argv) < 3:
-    print "Usage: %s datasetDirectory csvFileName.csv" % sys.argv[0]
+    print "Usage: %s datasetDirectory csvFileName.csv [double|single]" % sys.argv[0]
     sys.exit(-1)
   
+  # Precision to run the analysis in - single precision halves the memory used
+  if len(sys.argv) > 3 and sys.argv[3] == 'single':
+    dtype = np.float32
+  else:
+    dtype = np.float64
+  
   ''' test
   ODFs = [onsetDetection.ODF.spectralDistance]
   downsamplingFactors = np.array([1])
@@ -39,8 +48,9 @@ if __name__ == "__main__":
   windows = [np.hanning]
   offsets = np.array([20])
     
-  # Get subdirectories for the input folder, corresponding to different MIDI files
-  directories = [os.path.join( sys.argv[1], folder ) for folder in os.listdir(sys.argv[1]) if os.path.isdir(os.path.join(sys.argv[1], folder)) and folder[0] is not '.']
+  # Get subdirectories for the input folder, corresponding to different MIDI files.  MIDI files in the
+  # input folder are used directly, with their test files synthesized in process.
+  directories = [os.path.join( sys.argv[1], folder ) for folder in os.listdir(sys.argv[1]) if (os.path.isdir(os.path.join(sys.argv[1], folder)) or os.path.splitext( folder )[1].lower() in ('.mid', '.midi')) and folder[0] is not '.']
   
   # The variations on the MIDI files
   filenames = []
@@ -53,6 +63,13 @@ if __name__ == "__main__":
   # Calculate number of tests about to be run
   nTests = np.product( [len(dimension) for dimension in (directories, ODFs, downsamplingFactors, frameSizes, hopSizeScales, windows, offsets)] )
   print "About to run " + str( nTests ) + " tests."
+  # Each file is scored against the file after it
+  pairs = [(2*n, 2*n + 1) for n in xrange( nFiles/2 )]
+  # Report how much work planning the stages saves over running each test from scratch
+  gridSearchPlannerArguments = (filenames, pairs, [ODF.__name__ for ODF in ODFs], downsamplingFactors, frameSizes, hopSizeScales, [window.__name__ for window in windows], offsets, dtype)
+  naiveCounts = gridSearchPlanner.getNaiveStageCounts( *gridSearchPlannerArguments[:-1] )
+  plannedCounts = gridSearchPlanner.getStageCounts( gridSearchPlanner.getPlan( '', *gridSearchPlannerArguments ) )
+  gridSearchPlanner.printSavings( naiveCounts, plannedCounts, len( directories ) )
   # Keep track of which test is being run
   testNumber = 0
   
@@ -61,44 +78,25 @@ if __name__ == "__main__":
   # Store the parameters corresponding to each result
   gridSearchResults = collections.defaultdict(list)
 
-  # The data, being manipulated each step of the way
-  audioData = {}
-  audioDataDownsampled = {}
-  spectrograms = {}
-  ODFOutput = {}
-  synchronizationScores = {}
-  
   # Test to plot histograms
   allAccuracies = np.zeros( nTests )
   
-  # Can we calculate the spectrogram from the previous spectrogram?
-  previousHopSizeScale = 0
-  
   for directory in directories:
-    # Read in wav data for each file - should try downsampling factors
-    for file in filenames: audioData[file], fs = utility.getWavData( os.path.join( directory, file ) )
-    for downsamplingFactor in downsamplingFactors:
-      for file in filenames: audioDataDownsampled[file] = scipy.signal.decimate( audioData[file], downsamplingFactor )
-      for frameSize, window, hopSizeScale in itertools.product( frameSizes, windows, hopSizeScales ):
-        if hopSizeScale < previousHopSizeScale and np.mod( previousHopSizeScale, hopSizeScale ) == 0:
-          # Instead of calculating a new spectrogram, just grab the frames
-          newHopRatio = previousHopSizeScale/hopSizeScale
-          for file in filenames: spectrograms[file] = spectrograms[file][::newHopRatio]
-        else:
-          # Calculate spectrograms - should not re-calculate if just the hop size changes.
-          for file in filenames: spectrograms[file] = utility.getSpectrogram( audioDataDownsampled[file], hop=frameSize/hopSizeScale, frameSize=frameSize, window=window( frameSize ) )
-        previousHopSizeScale = hopSizeScale
-        for ODF in ODFs:
-          # Get the onset detection function
-          for file in filenames: ODFOutput[file] = onsetDetection.ODF( spectrograms[file], ODF, fs=fs/downsamplingFactor ).onsetDetectionFunction
-          for offset in offsets:
-            # Compute the synchronization score for the syncrhonized and unsynchronized files
-            for n in xrange( nFiles/2 ):
-              synchronizationScores[n] = synchronizationScore.getScore( ODFOutput[filenames[2*n]], ODFOutput[filenames[2*n + 1]], offset=offset )
-            # Add in the ratio of the scores, we will take the per-MIDI-file-average later.
-            print "{} -> {}, {:.3f}% done in {:.3f} minutes".format( (directory, ODF.__name__, downsamplingFactor, frameSize, hopSizeScale, window.__name__, offset), synchronizationScores.values(), (100.0*testNumber)/nTests, (time.time() - startTime)/60.0)
-            testNumber += 1
-            gridSearchResults[(ODF.__name__, downsamplingFactor, frameSize, hopSizeScale, window.__name__, offset)] += [np.array(synchronizationScores.values())]
+    # Run the stages for every test on this directory, sharing intermediate results between tests
+    plan = gridSearchPlanner.getPlan( directory, *gridSearchPlannerArguments )
+    for stage, synchronizationScores in gridSearchPlanner.executePlan( plan ):
+      for m, offset in enumerate( offsets ):
+        offsetScores = [scores[m] for scores in synchronizationScores]
+        # Add in the ratio of the scores, we will take the per-MIDI-file-average later.
+        print "{} -> {}, {:.3f}% done in {:.3f} minutes".format( (directory,) + stage.parameters + (offset,), offsetScores, (100.0*testNumber)/nTests, (time.time() - startTime)/60.0)
+        testNumber += 1
+        gridSearchResults[stage.parameters + (offset,)] += [np.array(offsetScores)]
+  if instrumentation.isEnabled():
+    instrumentation.printSummary()
+  
+  # Write out the raw scores of each pair of files for each directory as a columnar store, for gridSearchResultsAnalyzer
+  testParameters = gridSearchResults.keys()
+  resultsStore.writeResults( os.path.splitext( sys.argv[2] )[0] + '.npz', testParameters, directories, scores=np.array( [gridSearchResults[parameters] for parameters in testParameters] ) )
   
   # Write out CSV results
   csvWriter = csv.writer( open( sys.argv[2], 'wb' ) )
@@ -1,5 +1,5 @@
 # batchCreateMIDITestFiles.py
-# Given some MIDI files, mes
+# Given some MIDI files, make the test files for each of them, in parallel
 #
 # Created by Colin Raffel on 10/7/10
 
@@ -8,18 +8,77 @@ import createMIDITestFiles
 import numpy as np
 import sys
 import os
+import csv
+import multiprocessing
+
+# The part of each MIDI file to use, in seconds
+start = 10
+end = 20
+# The jitter scales to make test files with, in ms
+randomScales = np.arange(0, 100, 10)
+# How to render the test files - 'synthesizer' or 'fluidsynth'
+renderer = 'synthesizer'
+
+# Make the test files for one MIDI file in outputDirectory.  Each MIDI file is parsed once, and each
+# test file's jitter is seeded by createMIDITestFiles.getRandomState, so that an incremental rebuild
+# makes the same files as a full one, and the same audio as getTestAudio.  Files which exist already
+# are skipped, and the MIDI file isn't parsed at all if they all do.  Returns the MIDI file and a list
+# of (test file, status) for its test files, where status is 'written' or 'existing'.
+def createTestFiles( (MIDIFile, outputDirectory, renderer) ):
+  outputFiles = [os.path.join( outputDirectory, str(index) + '-' + str(randomScale) + 'ms.wav' ) for index in xrange( 2 ) for randomScale in randomScales]
+  existingFiles = set( [file for file in outputFiles if os.path.exists( file )] )
+  if len( existingFiles ) == len( outputFiles ):
+    return MIDIFile, [(file, 'existing') for file in outputFiles]
+  if not os.path.exists( outputDirectory ):
+    os.makedirs( outputDirectory )
+  # Don't let one bad MIDI file stop the whole batch
+  try:
+    filesWritten = createMIDITestFiles.MIDIToTestFiles( MIDIFile ).createMIDITestFiles( outputDirectory, start, end, randomScales, True, renderer )
+  except Exception as e:
+    print "Couldn't create test files for {}: {}".format( MIDIFile, e )
+    filesWritten = []
+  if len( os.listdir( outputDirectory ) ) == 0:
+    os.rmdir( outputDirectory )
+  return MIDIFile, [(file, 'existing' if file in existingFiles else 'written') for file in filesWritten]
 
 if __name__ == "__main__":
   if len(sys.argv) < 3:
-    print "Usage: %s datasetDirectory outputDirectory" % sys.argv[0]
+    print "Usage: %s datasetDirectory outputDirectory [nWorkers] [synthesizer|fluidsynth]" % sys.argv[0]
     sys.exit(-1)
 
-  files = utility.getFiles( sys.argv[1], '.mid' )
+  if len(sys.argv) > 3:
+    nWorkers = int(sys.argv[3])
+  else:
+    nWorkers = multiprocessing.cpu_count()
+
+  if len(sys.argv) > 4:
+    renderer = sys.argv[4]
 
+  files = sorted( utility.getFiles( sys.argv[1], '.mid' ) )
+  workUnits = [(file, os.path.join( sys.argv[2], os.path.split( os.path.splitext( file )[0] )[1] ), renderer) for file in files]
+
+  if nWorkers > 1:
+    pool = multiprocessing.Pool( nWorkers )
+    unitResults = pool.imap_unordered( createTestFiles, workUnits )
+  else:
+    unitResults = (createTestFiles( workUnit ) for workUnit in workUnits)
+
+  # The test files made from each MIDI file
+  manifest = {}
+  for n, (MIDIFile, testFiles) in enumerate( unitResults ):
+    manifest[MIDIFile] = testFiles
+    print "{} -> {} written, {} existing, {}/{} MIDI files done".format( MIDIFile, len( [status for file, status in testFiles if status == 'written'] ), len( [status for file, status in testFiles if status == 'existing'] ), n + 1, len( workUnits ) )
+  if nWorkers > 1:
+    pool.close()
+    pool.join()
+
+  # Write out a manifest of the test files made from each MIDI file, in the order of the MIDI files.
+  # MIDI files no test files could be made from are listed without any.
+  if not os.path.exists( sys.argv[2] ):
+    os.makedirs( sys.argv[2] )
+  csvWriter = csv.writer( open( os.path.join( sys.argv[2], 'manifest.csv' ), 'wb' ) )
   for file in files:
-    filename = os.path.split( os.path.splitext( file )[0] )[1]
-    outputDirectory = os.path.join( sys.argv[2], filename )
-    os.makedirs( outputDirectory )
-    filesWritten = createMIDITestFiles.MIDIToTestFiles( file ).createMIDITestFiles( outputDirectory, 10, 20, np.arange(0, 100, 10) )
-    if len(filesWritten) is 0:
-      os.rmdir( outputDirectory )
\ No newline at end of file
+    if len( manifest[file] ) == 0:
+      csvWriter.writerow( [file, '', 'none'] )
+    for testFile, status in manifest[file]:
+      csvWriter.writerow( [file, testFile, status] )
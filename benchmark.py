@@ -0,0 +1,198 @@
+# benchmark.py
+# Times the analysis stages (spectrogram, each ODF, mel spectrum and synchronization score) on
+# deterministic synthetic signals of several lengths, across frame sizes and hops, and records the
+# peak memory each uses.  Results are written as JSON, and can be compared against a baseline run to
+# flag regressions.
+#
+# Usage: benchmark.py results.json [baseline.json] [tolerance]
+
+import sys
+import json
+import platform
+import resource
+import timeit
+import multiprocessing
+import numpy as np
+import utility
+import onsetDetection
+import mfcc
+import synchronizationScore
+import cache
+
+# Sampling rate of the synthetic signals
+fs = 22050
+# Signal durations, in seconds
+durations = [10, 60]
+frameSizes = [1024, 2048, 4096]
+hopSizeScales = [4, 1]
+ODFNames = onsetDetection.batchableODFs
+# Each case is timed this many times, and the fastest is kept
+repeats = 5
+
+# Get the times of an onset train with onsets at the given rate on average (in onsets per second).
+# The same seed always gives the same onsets.
+def getOnsetTrain( duration, rate=4.0, seed=0 ):
+  randomState = np.random.RandomState( seed )
+  return np.sort( randomState.uniform( 0, duration, int( duration*rate ) ) )
+
+# Move each onset in an onset train by a random amount with the given standard deviation, in seconds,
+# as a less synchronized performer would
+def jitterOnsetTrain( onsets, deviation=0.02, seed=1 ):
+  randomState = np.random.RandomState( seed )
+  return np.clip( onsets + randomState.normal( 0, deviation, onsets.shape[0] ), 0, np.inf )
+
+# Synthesize a signal with a decaying harmonic note at each onset
+def getSyntheticSignal( onsets, duration, seed=0 ):
+  randomState = np.random.RandomState( seed )
+  signal = np.zeros( int( duration*fs ) )
+  # Notes last half a second
+  noteTime = np.arange( int( 0.5*fs ) )/(1.0*fs)
+  envelope = np.exp( -8.0*noteTime )
+  for onset, note in zip( onsets, randomState.randint( 48, 84, onsets.shape[0] ) ):
+    frequency = utility.midiToHz( note )
+    tone = sum( [np.sin( 2*np.pi*harmonic*frequency*noteTime )/harmonic for harmonic in xrange( 1, 5 )] )
+    start = int( onset*fs )
+    end = min( start + noteTime.shape[0], signal.shape[0] )
+    signal[start:end] += (envelope*tone)[:end - start]
+  # A little noise, so that no frame is silent
+  signal += 1e-3*randomState.randn( signal.shape[0] )
+  return signal/np.max( np.abs( signal ) )
+
+# Get the cases to run: the spectrogram, each ODF and the mel spectrum for every duration, frame
+# size and hop, and the synchronization score for every duration and hop
+def getCases():
+  cases = []
+  for duration in durations:
+    for frameSize in frameSizes:
+      for hopSizeScale in hopSizeScales:
+        for stage in ['spectrogram'] + ['ODF.' + ODFName for ODFName in ODFNames] + ['melSpectrum', 'score']:
+          cases.append( {'stage': stage, 'duration': duration, 'frameSize': frameSize, 'hop': frameSize/hopSizeScale} )
+  return cases
+
+# Key identifying a case, for comparing against a baseline
+def getCaseKey( case ):
+  return (case['stage'], case['duration'], case['frameSize'], case['hop'])
+
+# Get a function which runs a case's stage, with its inputs already computed so they aren't timed
+def getStageFunction( case ):
+  duration, frameSize, hop = case['duration'], case['frameSize'], case['hop']
+  window = np.hanning( frameSize )
+  onsets = getOnsetTrain( duration )
+  signal = getSyntheticSignal( onsets, duration )
+  if case['stage'] == 'spectrogram':
+    return lambda: utility.getSpectrogram( signal, hop=hop, frameSize=frameSize, window=window )
+  spectrogram = utility.getSpectrogram( signal, hop=hop, frameSize=frameSize, window=window )
+  if case['stage'].startswith( 'ODF.' ):
+    # A new ODF object each time, so intermediate results aren't reused between repeats
+    onsetDetectionAlgorithm = getattr( onsetDetection.ODF, case['stage'][4:] )
+    return lambda: onsetDetection.ODF( spectrogram, onsetDetectionAlgorithm, fs=fs ).onsetDetectionFunction
+  if case['stage'] == 'melSpectrum':
+    melFilters = mfcc.MFCC( fs, frameSize )
+    return lambda: melFilters.getMelSpectrum( spectrogram )
+  if case['stage'] == 'score':
+    otherSignal = getSyntheticSignal( jitterOnsetTrain( onsets ), duration )
+    otherSpectrogram = utility.getSpectrogram( otherSignal, hop=hop, frameSize=frameSize, window=window )
+    performer1ODF = onsetDetection.ODF( spectrogram, onsetDetection.ODF.spectralDistance ).onsetDetectionFunction
+    performer2ODF = onsetDetection.ODF( otherSpectrogram, onsetDetection.ODF.spectralDistance ).onsetDetectionFunction
+    return lambda: synchronizationScore.getScore( performer1ODF, performer2ODF )
+  raise ValueError( "Unknown stage %s" % case['stage'] )
+
+# Get a field of /proc/self/status in kilobytes, or None where it isn't available
+def getProcessStatus( field ):
+  try:
+    with open( '/proc/self/status' ) as f:
+      for line in f:
+        if line.startswith( field + ':' ):
+          return int( line.split()[1] )
+  except IOError:
+    pass
+  return None
+
+# Get the peak resident memory of this process, in kilobytes
+def getPeakMemory():
+  peakMemory = getProcessStatus( 'VmHWM' )
+  if peakMemory is None:
+    peakMemory = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+  return peakMemory
+
+# Reset the peak resident memory to the current resident memory, where the system allows it (Linux),
+# and return the current resident memory in kilobytes
+def resetPeakMemory():
+  try:
+    with open( '/proc/self/clear_refs', 'w' ) as f:
+      f.write( '5' )
+  except IOError:
+    pass
+  currentMemory = getProcessStatus( 'VmRSS' )
+  if currentMemory is None:
+    currentMemory = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+  return currentMemory
+
+# Run one case, returning its timings and peak memory.  Each case is run in its own process, and the
+# peak is reset once the case's inputs have been computed, so that the memory the stage uses (in
+# kilobytes) only reflects that stage.
+def runCase( case ):
+  # Time the computation, not the cache
+  cache.disable()
+  stageFunction = getStageFunction( case )
+  memoryBefore = resetPeakMemory()
+  times = []
+  for repeat in xrange( repeats ):
+    startTime = timeit.default_timer()
+    stageFunction()
+    times.append( timeit.default_timer() - startTime )
+  memoryAfter = getPeakMemory()
+  result = dict( case )
+  result.update( {'time': min( times ), 'times': times, 'peakMemory': memoryAfter, 'stageMemory': memoryAfter - memoryBefore} )
+  return result
+
+# Run every case, each in a fresh process
+def runBenchmarks():
+  pool = multiprocessing.Pool( 1, maxtasksperchild=1 )
+  results = []
+  for result in pool.imap( runCase, getCases(), chunksize=1 ):
+    print "{:>24} {:>6}s {:>6} {:>6}: {:10.6f}s {:10d}kB".format( result['stage'], result['duration'], result['frameSize'], result['hop'], result['time'], result['stageMemory'] )
+    results.append( result )
+  pool.close()
+  pool.join()
+  return results
+
+# Compare results against a baseline.  A case regresses when it takes more than tolerance times as long
+# as in the baseline, or when its stage uses more than tolerance times as much memory.  Changes of under
+# a millisecond or a megabyte are ignored, as they're within the noise.  Returns the regressed cases' keys.
+def compareToBaseline( results, baselineResults, tolerance=1.5 ):
+  baseline = dict( (getCaseKey( result ), result) for result in baselineResults )
+  regressions = []
+  print "{:>24} {:>6} {:>6} {:>6} {:>10} {:>10}".format( 'Stage', 'Length', 'Frame', 'Hop', 'Time ratio', 'Mem ratio' )
+  for result in results:
+    key = getCaseKey( result )
+    if key not in baseline:
+      continue
+    timeRatio = result['time']/max( baseline[key]['time'], 1e-9 )
+    memoryRatio = result['stageMemory']/max( baseline[key]['stageMemory'], 1024.0 )
+    regressed = (timeRatio > tolerance and result['time'] - baseline[key]['time'] > 1e-3) or (memoryRatio > tolerance and result['stageMemory'] - baseline[key]['stageMemory'] > 1024)
+    print "{:>24} {:>6} {:>6} {:>6} {:10.3f} {:10.3f}{}".format( key[0], key[1], key[2], key[3], timeRatio, memoryRatio, '  REGRESSION' if regressed else '' )
+    if regressed:
+      regressions.append( key )
+  return regressions
+
+if __name__ == "__main__":
+  if len(sys.argv) < 2:
+    print "Usage: %s results.json [baseline.json] [tolerance]" % sys.argv[0]
+    sys.exit(-1)
+
+  results = runBenchmarks()
+  with open( sys.argv[1], 'wb' ) as f:
+    json.dump( {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'fs': fs, 'repeats': repeats, 'results': results}, f, indent=1 )
+
+  if len(sys.argv) > 2:
+    with open( sys.argv[2], 'rb' ) as f:
+      baselineResults = json.load( f )['results']
+    if len(sys.argv) > 3:
+      tolerance = float(sys.argv[3])
+    else:
+      tolerance = 1.5
+    regressions = compareToBaseline( results, baselineResults, tolerance )
+    print "{} regressions".format( len( regressions ) )
+    if len( regressions ) > 0:
+      sys.exit(1)
@@ -0,0 +1,170 @@
+# cache.py
+# Content-addressed on-disk cache for intermediate results (decoded audio, decimated signals,
+# spectrograms and ODFs), stored as memory-mappable .npy files.
+#
+# Caching is off unless enable() is called or the SYNCHRONIZATION_CACHE environment variable is set
+# to a directory.  SYNCHRONIZATION_CACHE_SIZE optionally sets the size cap, in bytes.
+
+import numpy as np
+import hashlib
+import os
+import tempfile
+import instrumentation
+
+# Where cached arrays are stored, or None when caching is disabled
+cacheDirectory = None
+# Size cap for the cache in bytes - least recently used entries are removed past this
+maxCacheSize = 10*2**30
+# The cache's size in bytes as of the last scan plus what's been stored since, or None before the
+# first scan, and the number of entries stored since the last scan
+cacheSize = None
+storesSinceScan = 0
+# Number of stores after which the cache is rescanned, even if it seems to be under its size cap
+storesPerScan = 100
+
+def enable( directory, maxSize=10*2**30 ):
+  global cacheDirectory, maxCacheSize, cacheSize
+  if not os.path.exists( directory ):
+    os.makedirs( directory )
+  cacheDirectory = directory
+  maxCacheSize = maxSize
+  # Scanned on the first store
+  cacheSize = None
+
+def disable():
+  global cacheDirectory
+  cacheDirectory = None
+
+def isEnabled():
+  return cacheDirectory is not None
+
+# Hashes of files' contents, by name, size and modification time, so each file is only read once
+fileHashes = {}
+
+# Hash of a file's contents, read in chunks
+def fileHash( filename, chunkSize=2**20 ):
+  status = os.stat( filename )
+  fileKey = (os.path.abspath( filename ), status.st_size, status.st_mtime)
+  if fileKey not in fileHashes:
+    hasher = hashlib.sha1()
+    with open( filename, 'rb' ) as f:
+      chunk = f.read( chunkSize )
+      while chunk:
+        hasher.update( chunk )
+        chunk = f.read( chunkSize )
+    fileHashes[fileKey] = hasher.hexdigest()
+  return fileHashes[fileKey]
+
+# Hash of an array's contents, type and shape
+def arrayHash( array ):
+  array = np.ascontiguousarray( array )
+  hasher = hashlib.sha1( array )
+  hasher.update( str( array.dtype ) + str( array.shape ) )
+  return hasher.hexdigest()
+
+# Key for the output of a stage of the analysis, given the hashes (or keys) of its inputs and its
+# parameters
+def getKey( stage, *parameters ):
+  return stage + '-' + hashlib.sha1( repr( parameters ) ).hexdigest()
+
+# Key for the output of a stage, chained from the key of its input and its parameters, so that
+# intermediate arrays never need to be hashed.  None, meaning don't cache, when caching is disabled or
+# the input has no key.
+def getChildKey( stage, parentKey, *parameters ):
+  if cacheDirectory is None or parentKey is None:
+    return None
+  return getKey( stage, parentKey, *parameters )
+
+def getPath( key ):
+  return os.path.join( cacheDirectory, key + '.npy' )
+
+# Get a cached array, memory-mapped read-only, or None if it isn't in the cache
+def load( key ):
+  path = getPath( key )
+  # Hits and misses are counted for each stage
+  stage = key.split( '-' )[0]
+  try:
+    array = np.load( path, mmap_mode='r' )
+  except (IOError, ValueError):
+    instrumentation.count( 'cacheMisses.' + stage )
+    return None
+  instrumentation.count( 'cacheHits.' + stage )
+  # Mark the entry as recently used
+  try:
+    os.utime( path, None )
+  except OSError:
+    pass
+  return np.asarray( array )
+
+# Store an array in the cache.  The array is written to a temporary file and renamed into place,
+# so that other processes never see a partially written entry.
+def store( key, array ):
+  global cacheSize, storesSinceScan
+  fileDescriptor, temporaryPath = tempfile.mkstemp( suffix='.tmp', dir=cacheDirectory )
+  with os.fdopen( fileDescriptor, 'wb' ) as f:
+    np.save( f, np.asarray( array ) )
+  # Keep a running total of the cache's size rather than listing the cache on every store
+  if cacheSize is None:
+    scan()
+  try:
+    cacheSize -= os.stat( getPath( key ) ).st_size
+  except OSError:
+    pass
+  os.rename( temporaryPath, getPath( key ) )
+  cacheSize += os.stat( getPath( key ) ).st_size
+  storesSinceScan += 1
+  # Other processes sharing the cache aren't counted, so the size is rescanned now and then
+  if cacheSize > maxCacheSize or storesSinceScan >= storesPerScan:
+    evict()
+
+# List the cache's entries, as (modification time, size, filename), and reset its running size
+def scan():
+  global cacheSize, storesSinceScan
+  entries = []
+  for filename in os.listdir( cacheDirectory ):
+    if os.path.splitext( filename )[1] != '.npy':
+      continue
+    try:
+      status = os.stat( os.path.join( cacheDirectory, filename ) )
+    except OSError:
+      continue
+    entries.append( (status.st_mtime, status.st_size, filename) )
+  cacheSize = sum( [size for modificationTime, size, filename in entries] )
+  storesSinceScan = 0
+  return entries
+
+# Remove the least recently used entries until the cache is under its size cap
+def evict():
+  global cacheSize
+  entries = scan()
+  if cacheSize <= maxCacheSize:
+    return
+  for modificationTime, size, filename in sorted( entries ):
+    try:
+      os.remove( os.path.join( cacheDirectory, filename ) )
+    except OSError:
+      pass
+    cacheSize -= size
+    if cacheSize <= maxCacheSize:
+      break
+
+# Get the output of a stage from the cache, or compute it with compute() and cache it.
+# When caching is disabled, this just calls compute().
+def cached( compute, stage, *parameters ):
+  if cacheDirectory is None:
+    return compute()
+  return cachedByKey( compute, getKey( stage, *parameters ) )
+
+# Get an array from the cache by its key, or compute it with compute() and cache it.  When caching is
+# disabled or the key is None, this just calls compute().
+def cachedByKey( compute, key ):
+  if cacheDirectory is None or key is None:
+    return compute()
+  array = load( key )
+  if array is None:
+    array = compute()
+    store( key, array )
+  return array
+
+if os.environ.get( 'SYNCHRONIZATION_CACHE' ):
+  enable( os.environ['SYNCHRONIZATION_CACHE'], int( os.environ.get( 'SYNCHRONIZATION_CACHE_SIZE', maxCacheSize ) ) )
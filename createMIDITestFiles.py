@@ -9,42 +9,68 @@ import os
 import random
 import string
 import tempfile
+import subprocess
+import zlib
+import synthesizer
+import utility
 
 class MIDIToTestFiles:
   def __init__( self, MIDIFile ):
     # Read in the MIDI data
     self.MIDIData = midi.read_midifile( MIDIFile )
     self.originalMIDIFile = MIDIFile
+    self.indexEvents()
 
-  def createMIDITestFiles( self, outputDirectory, start, end, randomScales ):
+  # Walk the tracks once, finding the tempo and indexing the events on each channel by their absolute
+  # tick, so that the tracks don't need to be walked again for each channel or test file
+  def indexEvents( self ):
+    # Scale for MIDI tick numbers, to convert to seconds
+    self.tickScale = 1
+    self.tempoEvent = None
+    # Sorted, unique ticks of each channel's note-ons
+    noteOnTicks = {}
+    # For each channel, a list for each track of the (absolute tick, event) pairs of the channel's
+    # program changes and note events, in order
+    self.channelEvents = {}
+    for track in self.MIDIData:
+      # We will need to increment ticks according to the ticks we find
+      currentTick = 0
+      trackEvents = {}
+      # Cycle through all events in the track
+      for event in track:
+        # Increment tick value because they can happen across channels
+        currentTick += event.tick
+        if event.name == 'Set Tempo':
+          if self.tempoEvent is None:
+            self.tickScale = 60.0/(event.get_bpm()*self.MIDIData.resolution)
+            self.tempoEvent = event
+          else:
+            print "Warning: Multiple tempi found."
+        elif event.name == 'Note On' or event.name == 'Note Off' or event.name == 'Program Change':
+          trackEvents.setdefault( event.channel, [] ).append( (currentTick, event) )
+          if event.name == 'Note On' and event.velocity > 0:
+            noteOnTicks.setdefault( event.channel, [] ).append( currentTick )
+      for channel, events in trackEvents.items():
+        self.channelEvents.setdefault( channel, [] ).append( events )
+    self.noteOnTicks = dict( (channel, np.unique( ticks )) for channel, ticks in noteOnTicks.items() )
+
+  # Write each channel of the best pair for each of randomScales.  Each file's jitter is seeded by
+  # getRandomState, so files which exist already can be skipped if skipExisting without changing the
+  # others.  renderer is 'fluidsynth' or 'synthesizer', as in writeFilesForChannel.  Returns the files
+  # written (or skipped).
+  def createMIDITestFiles( self, outputDirectory, start, end, randomScales, skipExisting=False, renderer='fluidsynth' ):
     channelsToUse = self.getBestChannels( start, end )
     filesWritten = []
     if channelsToUse is None:
       return filesWritten
     for index, channel in enumerate( channelsToUse ):
-      for randomScale in randomScales:
-        file = os.path.join( outputDirectory, str(index) + '-' + str(randomScale) + 'ms.wav' )
-        self.writeFileForChannel( file, channel, start, end, randomScale )
-        filesWritten.append( file )
+      files = [os.path.join( outputDirectory, str(index) + '-' + str(randomScale) + 'ms.wav' ) for randomScale in randomScales]
+      randomStates = [getRandomState( self.originalMIDIFile, file ) for file in files]
+      filesWritten += self.writeFilesForChannel( files, channel, start, end, randomScales, skipExisting, randomStates, renderer )
     return filesWritten
     
   def getTickScaling( self ):
-    # Scale for MIDI tick numbers, to convert to seconds
-    tickScale = 1
-    foundTempo = 0
-    tempoEvent = None
-    # Find the tempo setting message
-    for track in self.MIDIData:
-      for event in track:
-        if event.name == 'Set Tempo':
-          if foundTempo:
-            print "Warning: Multiple tempi found."
-            break
-          else:
-            tickScale = 60.0/(event.get_bpm()*self.MIDIData.resolution)
-            tempoEvent = event
-            foundTempo = 1
-    return tickScale, tempoEvent
+    return self.tickScale, self.tempoEvent
   
   def getBestChannels( self, start, end ):
 
@@ -57,25 +83,12 @@ class MIDIToTestFiles:
     start = int( start/tickScale )
     end = int( end/tickScale )
         
+    # The unique ticks of each channel's note-ons within the time limits we care about
     eventLocations = {}
-
-    # Cycle through tracks to find note-on events in the specified channel
-    for track in self.MIDIData:
-      # We will need to increment ticks according to the ticks we find
-      currentTick = 0
-      hasNotes = 0
-      # Cycle through all events in the track
-      for event in track:
-        # Increment tick value because they can happen across channels
-        currentTick += event.tick
-        # Are we within the time limits we care about?
-        if currentTick > start and currentTick < end:
-          # Only record note on events
-          if event.name == 'Note On' and event.velocity > 0:
-            if eventLocations.has_key( event.channel ) and eventLocations[event.channel].count( currentTick ) == 0:
-              eventLocations[event.channel].append( currentTick )
-            else:
-              eventLocations[event.channel] = [currentTick]
+    for channel, ticks in self.noteOnTicks.items():
+      ticks = ticks[np.searchsorted( ticks, start, side='right' ):np.searchsorted( ticks, end, side='left' )]
+      if ticks.shape[0] > 0:
+        eventLocations[channel] = ticks
   
     bestNumberOfMatches = 0
     bestPair = None
@@ -83,95 +96,191 @@ class MIDIToTestFiles:
       for compareChannel in eventLocations:
         if mainChannel == compareChannel:
           continue
-        matches = 0
-        for tick in eventLocations[mainChannel]:
-          matches += eventLocations[compareChannel].count( tick )
+        # Number of ticks where both channels have a note-on
+        matches = np.intersect1d( eventLocations[mainChannel], eventLocations[compareChannel], assume_unique=True ).shape[0]
         if matches > bestNumberOfMatches:
           bestNumberOfMatches = matches
           bestPair = (mainChannel, compareChannel)
     
     return bestPair
     
-  # Write out the unique time of note-ons
-  def writeFileForChannel( self, filename, channel, start, end, randomScale ):
-    
-    # Hold all the tracks in our output pattern
-    tracks = []
-
+  # Get the events on a channel in each track with notes within the time limits, with the delta ticks
+  # they're written with for each of randomScales (in ms).  Each note is written the time since the
+  # last note (or start) later, plus Gaussian jitter, but never before the last note; program changes
+  # are written one tick after the last event.  Each scale's jitter is drawn from the corresponding
+  # random state in randomStates (np.random for all of them by default).  Returns a list of (events,
+  # delta ticks) for each track, where the delta ticks are an array with a row for each random scale.
+  def getJitteredTracks( self, channel, start, end, randomScales, randomStates=None ):
     tickScale, tempoEvent = self.getTickScaling()
-    
-    # Convert random scale to 1/2 std. dev. with tick scaling
-    randomScale = (randomScale/2.0)/tickScale
-    # Convert to ms
-    randomScale /= 1000.0
-    
-    if tempoEvent is None:
-      return 0
-  
+    if randomStates is None:
+      randomStates = [np.random]*len( randomScales )
+    # Convert random scale to 1/2 std. dev. with tick scaling, in ms
+    randomScales = ((np.asarray( randomScales, dtype=np.float64 )/2.0)/tickScale)/1000.0
     # Recalculate start and end times according to tick location
     start = int( start/tickScale )
     end = int( end/tickScale )
+    tracks = []
+    for trackEvents in self.channelEvents.get( channel, [] ):
+      ticks = np.array( [tick for tick, event in trackEvents] )
+      isProgramChange = np.array( [event.name == 'Program Change' for tick, event in trackEvents] )
+      # Are we within the time limits we care about?
+      isNote = np.logical_not( isProgramChange ) & (ticks > start) & (ticks < end)
+      if not isNote.any():
+        continue
+      noteTicks = ticks[isNote]
+      noise = np.array( [randomState.randn( noteTicks.shape[0] ) for randomState in randomStates] ).reshape( randomScales.shape[0], noteTicks.shape[0] )
+      jitter = (randomScales[:, np.newaxis]*noise).astype( np.int )
+      deltaTicks = np.ones( (randomScales.shape[0], ticks.shape[0]), dtype=np.int )
+      deltaTicks[:, isNote] = np.clip( np.diff( np.append( start, noteTicks ) ) + jitter, 0, None )
+      # Keep the instrument in tact
+      kept = np.flatnonzero( isProgramChange | isNote )
+      tracks.append( ([trackEvents[n][1] for n in kept], deltaTicks[:, kept]) )
+    return tracks
+
+  # Get the MIDI pattern for row n of jittered tracks from getJitteredTracks
+  def getPattern( self, tracks, n, channel ):
+    tickScale, tempoEvent = self.getTickScaling()
     # Do we even need this track?  I don't know.
-    tracks.append( [midi.TimeSignatureEvent(tick=0, data=[4, 2, 24, 8]),
-                    midi.KeySignatureEvent(tick=0, data=[0, 0]),
-                    midi.EndOfTrackEvent(tick=1, data=[])] )
+    outputTracks = [[midi.TimeSignatureEvent(tick=0, data=[4, 2, 24, 8]),
+                     midi.KeySignatureEvent(tick=0, data=[0, 0]),
+                     midi.EndOfTrackEvent(tick=1, data=[])]]
+    for events, deltaTicks in tracks:
+      currentTrack = [tempoEvent]
+      for event, tick in zip( events, deltaTicks[n] ):
+        if event.name == 'Program Change':
+          currentTrack.append( midi.ProgramChangeEvent( tick=int( tick ), channel=channel, data=event.data ) )
+        elif event.name == 'Note On':
+          currentTrack.append( midi.NoteOnEvent( tick=int( tick ), channel = event.channel, data = event.data ) )
+        else:
+          currentTrack.append( midi.NoteOffEvent( tick=int( tick ), channel = event.channel, data = event.data ) )
+      currentTrack.append( midi.EndOfTrackEvent(tick=1, data=[]) )
+      outputTracks.append( currentTrack )
+    return midi.Pattern( tracks=outputTracks, resolution=self.MIDIData.resolution )
 
-    # Cycle through tracks to find note-on events in the specified channel
-    for track in self.MIDIData:
-      # Current track we're constructing
-      currentTrack = []
-      # We will need to increment ticks according to the ticks we find
-      currentTick = 0
-      time = 0
-      lastTick = start
-      hasNotes = 0
-      # Cycle through all events in the track
-      for event in track:
-        # Keep the instrument in tact
-        if event.name == 'Program Change' and event.channel == channel:
-          currentTrack.append( midi.ProgramChangeEvent( tick=1, channel=channel, data=event.data ) )
-        # Increment tick value because they can happen across channels
-        currentTick += event.tick
-        # Are we within the time limits we care about?
-        if currentTick > start and currentTick < end:
-          # Only record note events
-          if event.name == 'Note On' or event.name == 'Note Off':
-            # Is this on the channel we're writing out?
-            if event.channel == channel:
-              tick = currentTick - lastTick + int(randomScale*np.random.randn())
-              if tick < 0:
-                tick = 0
-              if event.name == 'Note On':
-                currentTrack.append( midi.NoteOnEvent( tick=tick, channel = event.channel, data = event.data ) )
-              else:
-                currentTrack.append( midi.NoteOffEvent( tick=tick, channel = event.channel, data = event.data ) )
-              lastTick = currentTick
-              hasNotes = 1
-      if hasNotes:
-        currentTrack.insert( 0, tempoEvent )
-        currentTrack.append( midi.EndOfTrackEvent(tick=1, data=[]) )
-        tracks.append( currentTrack )
-    
-    if len( tracks ) > 1:
-      # Construct MIDI pattern...
-      pattern = midi.Pattern( tracks=tracks, resolution=self.MIDIData.resolution )
-      # And write it out to a temp location...
-      tempMIDIFile = tempfile.NamedTemporaryFile()
-      midi.write_midifile( tempMIDIFile.name, pattern )
-      # Write the wav
-      os.system( 'fluidsynth -a file -F "' + filename + '" -g 1 -T wav SGM-V2.01.sf2 "' + tempMIDIFile.name + '"' )
-      tempMIDIFile.close()
-      return 1
-    else:
+  # Get the notes of row n of jittered tracks from getJitteredTracks, as arrays of onsets and durations
+  # (in seconds, from the start of the written file), pitches and velocities
+  def getNotes( self, tracks, n ):
+    tickScale, tempoEvent = self.getTickScaling()
+    notes = []
+    for events, deltaTicks in tracks:
+      writtenTicks = tempoEvent.tick + np.cumsum( deltaTicks[n] )
+      # Match each note-on with the next note-off of the same pitch
+      notesOn = {}
+      for tick, event in zip( writtenTicks, events ):
+        if event.name == 'Program Change':
+          continue
+        if event.name == 'Note On' and event.velocity > 0:
+          notesOn.setdefault( event.pitch, [] ).append( (tick, event.velocity) )
+        elif len( notesOn.get( event.pitch, [] ) ) > 0:
+          onTick, velocity = notesOn[event.pitch].pop( 0 )
+          notes.append( (onTick, tick - onTick, event.pitch, velocity) )
+      # Notes which are never turned off last until the track's last event
+      for pitch, onNotes in notesOn.items():
+        for onTick, velocity in onNotes:
+          notes.append( (onTick, writtenTicks[-1] - onTick, pitch, velocity) )
+    if len( notes ) == 0:
+      return np.zeros( 0 ), np.zeros( 0 ), np.zeros( 0, dtype=np.int ), np.zeros( 0, dtype=np.int )
+    notes = np.array( sorted( notes ) )
+    return notes[:, 0]*tickScale, notes[:, 1]*tickScale, notes[:, 2].astype( np.int ), notes[:, 3].astype( np.int )
+
+  # Write out the unique time of note-ons, for each of randomScales, to the corresponding file in
+  # filenames, with jitter drawn from the corresponding random state in randomStates.  With the
+  # 'fluidsynth' renderer, the MIDI for each file is rendered by a fluidsynth process, one file at a
+  # time (to render in parallel, run several of these at once, as batchCreateMIDIFiles does); with
+  # 'synthesizer', the notes are rendered in process by the synthesizer module.  Each file is
+  # written under a temporary name until it's rendered, so that an interrupted or failed render isn't
+  # mistaken for a finished file.  Returns the files written (or skipped, when they exist already and
+  # skipExisting).
+  def writeFilesForChannel( self, filenames, channel, start, end, randomScales, skipExisting=False, randomStates=None, renderer='fluidsynth', fs=44100, voice='additive' ):
+    if renderer not in ('fluidsynth', 'synthesizer'):
+      raise ValueError( "Unknown renderer %s" % renderer )
+    tickScale, tempoEvent = self.getTickScaling()
+    if tempoEvent is None:
+      return []
+    tracks = self.getJitteredTracks( channel, start, end, randomScales, randomStates )
+    if len( tracks ) == 0:
       print "No events found on that track!"
-      return 0
-    
-  
+      return []
+    filesWritten = set()
+    for n, filename in enumerate( filenames ):
+      if skipExisting and os.path.exists( filename ):
+        filesWritten.add( filename )
+      elif renderer == 'synthesizer':
+        audioData = synthesizer.synthesize( *self.getNotes( tracks, n ), fs=fs, voice=voice )
+        if audioData.shape[0] == 0 or np.max( np.abs( audioData ) ) == 0:
+          print "Nothing to render for %s" % filename
+          continue
+        utility.writeWav( audioData, fs, filename + '.part' )
+        os.rename( filename + '.part', filename )
+        filesWritten.add( filename )
+      else:
+        # Write the MIDI out to a temp location, and render it to the wav
+        tempMIDIFile = tempfile.NamedTemporaryFile()
+        midi.write_midifile( tempMIDIFile.name, self.getPattern( tracks, n, channel ) )
+        returnCode = subprocess.call( ['fluidsynth', '-a', 'file', '-F', filename + '.part', '-g', '1', '-T', 'wav', 'SGM-V2.01.sf2', tempMIDIFile.name] )
+        tempMIDIFile.close()
+        if returnCode == 0 and os.path.exists( filename + '.part' ):
+          os.rename( filename + '.part', filename )
+          filesWritten.add( filename )
+        else:
+          print "fluidsynth failed to render %s (exit status %d)" % (filename, returnCode)
+          if os.path.exists( filename + '.part' ):
+            os.remove( filename + '.part' )
+    return [filename for filename in filenames if filename in filesWritten]
+
+  # Write out the unique time of note-ons for a single random scale
+  def writeFileForChannel( self, filename, channel, start, end, randomScale ):
+    return len( self.writeFilesForChannel( [filename], channel, start, end, [randomScale] ) )
+
+  # Get the notes writeFileForChannel would write for a channel, as arrays of onsets and durations (in
+  # seconds, from the start of the written file), pitches and velocities.  The timing is jittered the
+  # same way, with jitter drawn from randomState, so the same seed gives the same notes.
+  def getNoteEvents( self, channel, start, end, randomScale, randomState=np.random ):
+    tickScale, tempoEvent = self.getTickScaling()
+    if tempoEvent is None:
+      return np.zeros( 0 ), np.zeros( 0 ), np.zeros( 0, dtype=np.int ), np.zeros( 0, dtype=np.int )
+    return self.getNotes( self.getJitteredTracks( channel, start, end, [randomScale], [randomState] ), 0 )
+
+  # Synthesize the audio for a channel in process, instead of writing it with fluidsynth
+  def synthesizeChannel( self, channel, start, end, randomScale, fs=44100, voice='additive', randomState=np.random, dtype=np.float64 ):
+    onsets, durations, pitches, velocities = self.getNoteEvents( channel, start, end, randomScale, randomState )
+    return synthesizer.synthesize( onsets, durations, pitches, velocities, fs, voice, dtype=dtype )
+
   # Write out the MIDI data as an audio file
   def writeWavFile( self, filename ):
     # Wish I could do this without subprocess, but the pyfluidsynth won't let me read in a MIDI file...
     os.system( 'fluidsynth -a file -F "' + filename + '" -g 1 -T wav SGM-V2.01.sf2 "' + self.MIDIFile + '"' )    
 
+# Random state for the jitter of a test file (such as 1-50ms.wav), seeded by the names of the MIDI
+# file and the test file, so that a test file gets the same jitter however it's made
+def getRandomState( MIDIFile, testFile ):
+  return np.random.RandomState( zlib.crc32( os.path.basename( MIDIFile ) + os.path.basename( testFile ) ) & 0xffffffff )
+
+# The MIDI file most recently synthesized from by getTestAudio, and its best channels
+testAudioSource = (None, None, None)
+
+# Synthesize the test file with the given name, like the ones createMIDITestFiles writes (such as
+# 1-50ms.wav), from a MIDI file in process.  The jitter is seeded by getRandomState, so the same audio
+# is synthesized every time, with the same jitter as createMIDITestFiles gives the file.  Returns the audio, normalized like
+# utility.getWavData, and the sampling rate.
+def getTestAudio( MIDIFile, filename, start=10, end=20, fs=44100, voice='additive', dtype=np.float64 ):
+  global testAudioSource
+  if testAudioSource[0] != MIDIFile:
+    converter = MIDIToTestFiles( MIDIFile )
+    testAudioSource = (MIDIFile, converter, converter.getBestChannels( start, end ))
+  MIDIFile, converter, channelsToUse = testAudioSource
+  if channelsToUse is None:
+    print "No pair of channels to use in %s" % MIDIFile
+    return np.array([]), 0
+  index, randomScale = os.path.splitext( filename )[0].split( '-' )
+  audioData = converter.synthesizeChannel( channelsToUse[int( index )], start, end, int( randomScale[:-2] ), fs, voice, getRandomState( MIDIFile, filename ) )
+  # Normalize, which silence can't be
+  peak = np.max( np.abs( audioData ) ) if audioData.shape[0] > 0 else 0
+  if peak == 0:
+    raise ValueError( "%s synthesized from %s is silent" % (filename, MIDIFile) )
+  audioData = (32767.0*audioData)/peak
+  return audioData.astype( dtype ), fs
+
 # Run function as script
 if __name__ == "__main__":
   import sys
@@ -0,0 +1,50 @@
+# gridSearchJournal.py
+# Append-only journal of grid search results, so that a grid search which is interrupted can pick up
+# where it left off.  Each result is written as a JSON line as soon as it arrives, keyed by
+# (directory, ODF, downsampling factor, frame size, hop size scale, window, offset).
+
+import numpy as np
+import os
+import json
+
+# Key for a result: the directory followed by the test's parameters, as plain python types so that
+# keys read back from the journal match the ones the grid search makes
+def getKey( directory, parameters ):
+  return (directory,) + tuple( [parameter.item() if isinstance( parameter, np.generic ) else parameter for parameter in parameters] )
+
+# Read the results in a journal into a dict of key -> (synchronized score, unsynchronized score).
+# Later results for a key replace earlier ones, and a partially written last line (from a crash) is
+# ignored.
+def readJournal( filename ):
+  results = {}
+  if not os.path.exists( filename ):
+    return results
+  with open( filename, 'rb' ) as f:
+    for line in f:
+      try:
+        record = json.loads( line )
+      except ValueError:
+        continue
+      results[getKey( record['directory'], record['parameters'] )] = (record['synchronizedScore'], record['unsynchronizedScore'])
+  return results
+
+# Open a journal to append results to
+def openJournal( filename ):
+  journal = open( filename, 'ab' )
+  # Start a new line after any partially written last line, so the next result can be read back
+  if os.path.getsize( filename ) > 0:
+    with open( filename, 'rb' ) as f:
+      f.seek( -1, os.SEEK_END )
+      if f.read( 1 ) != '\n':
+        journal.write( '\n' )
+  return journal
+
+# Append a result to the journal, flushing it to the operating system straight away
+def writeResult( journal, directory, parameters, synchronizedScore, unsynchronizedScore ):
+  journal.write( json.dumps( {'directory': directory, 'parameters': getKey( directory, parameters )[1:], 'synchronizedScore': float( synchronizedScore ), 'unsynchronizedScore': float( unsynchronizedScore )} ) + '\n' )
+  journal.flush()
+
+# Make sure everything written to the journal so far is on disk
+def syncJournal( journal ):
+  journal.flush()
+  os.fsync( journal.fileno() )
@@ -0,0 +1,147 @@
+# gridSearchPlanner.py
+# Plans the work for one directory of a grid search as a graph of stages
+#   decode -> decimate -> STFT at the finest hop -> hop subsampling -> ODF -> score
+# ordered so that each intermediate result is computed once and only kept around while stages which
+# use it are still to be run.
+
+import numpy as np
+import utility
+import os
+import collections
+import onsetDetection
+import synchronizationScore
+import instrumentation
+import cache
+
+# The stages of the analysis, in the order they're run
+stageNames = ['decode', 'decimate', 'STFT', 'subsample', 'ODF', 'score']
+
+# One step of the plan.  compute is called with the outputs of the stages whose keys are in inputs.
+# count is the number of per-file (or per-pair) computations the stage does, for reporting.
+class Stage:
+  def __init__( self, name, key, inputs, compute, count, parameters=None ):
+    self.name = name
+    self.key = key
+    self.inputs = inputs
+    self.compute = compute
+    self.count = count
+    # For score stages, the grid search parameters (without the offset) the scores are for
+    self.parameters = parameters
+
+# Get the hop size scale each hop size scale's spectrogram is subsampled from.  A spectrogram can be
+# subsampled from one with a larger hop size scale which it divides, so every scale is taken from the
+# largest such scale, and spectrograms are only computed for scales which don't divide a larger one.
+def getRootHopSizeScales( hopSizeScales ):
+  roots = {}
+  for hopSizeScale in hopSizeScales:
+    roots[hopSizeScale] = max( [scale for scale in hopSizeScales if np.mod( scale, hopSizeScale ) == 0] )
+  return roots
+
+# Read a file of a directory, or synthesize it in process if the "directory" is a MIDI file.  Returns
+# the audio, its sampling rate and its cache key, which the keys of everything computed from it are
+# chained from (None when caching is disabled).
+def decode( directory, file, dtype=np.float64 ):
+  if os.path.splitext( directory )[1].lower() in ('.mid', '.midi'):
+    # Only needed (and python-midi only required) when synthesizing
+    import createMIDITestFiles
+    audioData, fs = createMIDITestFiles.getTestAudio( directory, file, dtype=dtype )
+    return audioData, fs, cache.getChildKey( 'synthesized', cache.fileHash( directory ) if cache.isEnabled() else None, file, np.dtype( dtype ).name )
+  audioData, fs = utility.getAudioData( os.path.join( directory, file ), dtype )
+  return audioData, fs, utility.getAudioCacheKey( os.path.join( directory, file ), dtype )
+
+# Get the spectrogram of a signal, with its sampling rate and cache key
+def getSpectrogram( audioData, fs, cacheKey, hop, frameSize, window ):
+  return utility.getSpectrogram( audioData, hop=hop, frameSize=frameSize, window=window, cacheKey=cacheKey ), fs, utility.getSpectrogramCacheKey( cacheKey, hop, frameSize, window )
+
+# Get the stages for running every test on one directory, in the order they should be run.
+# pairs are the indices into filenames of the pairs of files to score against each other.
+def getPlan( directory, filenames, pairs, ODFNames, downsamplingFactors, frameSizes, hopSizeScales, windowNames, offsets, dtype=np.float64 ):
+  plan = []
+  rootHopSizeScales = getRootHopSizeScales( hopSizeScales )
+  # Largest scales first, so each spectrogram is computed before the ones subsampled from it
+  hopSizeScales = sorted( hopSizeScales, reverse=True )
+  for file in filenames:
+    plan.append( Stage( 'decode', ('decode', file), [], lambda file=file: decode( directory, file, dtype ), 1 ) )
+  for downsamplingFactor in downsamplingFactors:
+    for file in filenames:
+      plan.append( Stage( 'decimate', ('decimate', file, downsamplingFactor), [('decode', file)], lambda (audioData, fs, cacheKey), downsamplingFactor=downsamplingFactor: (utility.downsample( audioData, downsamplingFactor, cacheKey ), fs/downsamplingFactor, utility.getDownsampledCacheKey( cacheKey, downsamplingFactor )), 1 ) )
+    for frameSize in frameSizes:
+      for windowName in windowNames:
+        for hopSizeScale in hopSizeScales:
+          root = rootHopSizeScales[hopSizeScale]
+          for file in filenames:
+            if hopSizeScale == root:
+              plan.append( Stage( 'STFT', ('spectrogram', file, downsamplingFactor, frameSize, windowName, hopSizeScale), [('decimate', file, downsamplingFactor)], lambda (audioData, fs, cacheKey), frameSize=frameSize, windowName=windowName, hopSizeScale=hopSizeScale: getSpectrogram( audioData, fs, cacheKey, frameSize/hopSizeScale, frameSize, getattr( np, windowName )( frameSize ) ), 1 ) )
+            else:
+              # Instead of calculating a new spectrogram, just grab the frames
+              plan.append( Stage( 'subsample', ('spectrogram', file, downsamplingFactor, frameSize, windowName, hopSizeScale), [('spectrogram', file, downsamplingFactor, frameSize, windowName, root)], lambda (spectrogram, fs, cacheKey), hopRatio=root/hopSizeScale: (spectrogram[::hopRatio], fs, cache.getChildKey( 'subsampled', cacheKey, hopRatio )), 1 ) )
+          # Get the onset detection functions of all of the files for every algorithm at once, so they share intermediate results
+          ODFKey = ('ODF', downsamplingFactor, frameSize, windowName, hopSizeScale)
+          plan.append( Stage( 'ODF', ODFKey, [('spectrogram', file, downsamplingFactor, frameSize, windowName, hopSizeScale) for file in filenames], lambda *spectrograms: onsetDetection.getODFsForAlgorithms( [spectrogram for spectrogram, fs, cacheKey in spectrograms], [getattr( onsetDetection.ODF, ODFName ) for ODFName in ODFNames], fs=spectrograms[0][1], cacheKeys=[cacheKey for spectrogram, fs, cacheKey in spectrograms] ), len( filenames )*len( ODFNames ) ) )
+          # Compute the synchronization scores for each pair of files at every offset at once
+          for n, ODFName in enumerate( ODFNames ):
+            plan.append( Stage( 'score', ('score', ODFName, downsamplingFactor, frameSize, hopSizeScale, windowName), [ODFKey], lambda allODFOutputs, n=n: [synchronizationScore.getScores( allODFOutputs[n][i], allODFOutputs[n][j], offsets ) for i, j in pairs], len( pairs ), (ODFName, downsamplingFactor, frameSize, hopSizeScale, windowName) ) )
+  return plan
+
+# Keep only the stages of a plan which are needed for the score stages whose parameters are in
+# scoreParameters, so that a directory's tests can be run in part
+def prunePlan( plan, scoreParameters ):
+  neededKeys = set()
+  prunedPlan = []
+  for stage in reversed( plan ):
+    if stage.key in neededKeys or (stage.name == 'score' and stage.parameters in scoreParameters):
+      neededKeys.update( stage.inputs )
+      prunedPlan.append( stage )
+  return prunedPlan[::-1]
+
+# Run the stages of a plan in order, dropping each intermediate result once the last stage which
+# uses it has been run.  Yields each stage whose output isn't used by another stage (the scores)
+# along with its output.  Each stage is timed when instrumentation is enabled.
+def executePlan( plan ):
+  # Number of stages still to be run which use each stage's output
+  consumers = collections.Counter( key for stage in plan for key in stage.inputs )
+  outputs = {}
+  for stage in plan:
+    inputs = [outputs[key] for key in stage.inputs]
+    with instrumentation.stage( stage.name ) as timer:
+      timer.addInputs( inputs )
+      output = stage.compute( *inputs )
+    for key in stage.inputs:
+      consumers[key] -= 1
+      if consumers[key] == 0:
+        del outputs[key]
+    if consumers[stage.key] > 0:
+      outputs[stage.key] = output
+    else:
+      yield stage, output
+
+# Number of computations of each stage in a plan
+def getStageCounts( plan ):
+  counts = collections.Counter()
+  for stage in plan:
+    counts[stage.name] += stage.count
+  return counts
+
+# Number of computations of each stage a naive sweep would do for one directory, running every test
+# from scratch: each file decoded, decimated, transformed and given an ODF for every test, and each
+# pair scored for every test.
+def getNaiveStageCounts( filenames, pairs, ODFNames, downsamplingFactors, frameSizes, hopSizeScales, windowNames, offsets ):
+  nTests = np.product( [len( dimension ) for dimension in (ODFNames, downsamplingFactors, frameSizes, hopSizeScales, windowNames, offsets)] )
+  counts = collections.Counter()
+  for name in ['decode', 'decimate', 'STFT', 'ODF']:
+    counts[name] = nTests*len( filenames )
+  counts['score'] = nTests*len( pairs )
+  return counts
+
+# Print how many stage computations the plan saves compared with a naive sweep, over nDirectories
+# directories.  Each subsampled spectrogram stands in for an STFT of the naive sweep, so they're
+# counted in the STFT row.
+def printSavings( naiveCounts, plannedCounts, nDirectories=1 ):
+  plannedCounts = collections.Counter( plannedCounts )
+  plannedCounts['STFT'] += plannedCounts.pop( 'subsample', 0 )
+  print "{:>10} {:>10} {:>10} {:>10}".format( 'Stage', 'Naive', 'Planned', 'Saved' )
+  for name in [name for name in stageNames if name != 'subsample']:
+    print "{:>10} {:>10} {:>10} {:>10}".format( name, nDirectories*naiveCounts[name], nDirectories*plannedCounts[name], nDirectories*(naiveCounts[name] - plannedCounts[name]) )
+  naiveTotal = nDirectories*sum( naiveCounts.values() )
+  plannedTotal = nDirectories*sum( plannedCounts.values() )
+  print "{:>10} {:>10} {:>10} {:>10} ({:.1f}%)".format( 'Total', naiveTotal, plannedTotal, naiveTotal - plannedTotal, (100.0*(naiveTotal - plannedTotal))/max( naiveTotal, 1 ) )
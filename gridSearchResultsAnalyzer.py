@@ -4,27 +4,211 @@
 # Created by Colin Raffel on 12/1/12
 
 import sys
+import os
 import csv
+import json
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
 import collections
+import resultsStore
+import runningStatistics
+
+# Quantiles given in summary reports
+reportQuantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+# Read the parameters and the last column (the fraction of pieces each test did well on) from a
+# grid search CSV file.  Returns each test's codes into each parameter's labels, the labels, and the
+# last column's values.
+def readCSVResults( filename, nDimensions ):
+  with open( filename, 'rb' ) as csvfile:
+    rows = list( csv.reader( csvfile, delimiter=',' ) )
+  parameters = np.array( [row[:nDimensions] for row in rows] ).reshape( -1, nDimensions )
+  accuracies = np.array( [float( row[-1] ) for row in rows] )
+  codes = np.zeros( parameters.shape, dtype=np.int32 )
+  labels = []
+  for n in xrange( nDimensions ):
+    dimensionLabels, codes[:, n] = np.unique( parameters[:, n], return_inverse=True )
+    labels += [dimensionLabels]
+  return codes, labels, accuracies
+
+# Read the parameter codes and labels from a results store written by a grid search, and compute the
+# same value as the last column of its CSV from the raw scores
+def readStoreResults( filename ):
+  results = resultsStore.readResults( filename )
+  return results['codes'], results['labels'], getStoreAccuracies( results )
+
+# Names of the score arrays in a results store, given the names of all of its arrays
+def getScoreNames( names ):
+  if 'synchronizedScores' in names:
+    return ['synchronizedScores', 'unsynchronizedScores']
+  return ['scores']
+
+# Compute the value in the last column of a grid search's CSV for each test, from the raw scores of
+# some of the tests in a results store
+def getStoreAccuracies( scores ):
+  if 'synchronizedScores' in scores:
+    # Fraction of pieces where the synchronized files scored higher than the unsynchronized files
+    logRatios = np.log( scores['synchronizedScores']/(scores['unsynchronizedScores'] + 1e-10) + 1e-10 )
+    return np.mean( logRatios > 0, axis=1 )
+  # Fraction of steps of increasing asynchrony which the scores decreased at, averaged over pieces
+  scores = scores['scores']
+  scores = scores/np.max( scores, axis=2 )[..., np.newaxis]
+  return np.mean( np.sum( np.diff( scores, axis=2 ) < 0, axis=2 ), axis=1 )/(scores.shape[2] - 1.0)
+
+# Get statistics of the values in each group, where codes gives each value's group.  Also returns the
+# order which sorts the values by group, and where each group starts in that order.
+def getGroupStatistics( codes, values, nGroups ):
+  counts = np.bincount( codes, minlength=nGroups )
+  means = np.bincount( codes, weights=values, minlength=nGroups )/np.maximum( counts, 1 )
+  standardDeviations = np.sqrt( np.bincount( codes, weights=(values - means[codes])**2, minlength=nGroups )/np.maximum( counts, 1 ) )
+  order = np.argsort( codes, kind='mergesort' )
+  starts = np.searchsorted( codes[order], np.arange( nGroups ) )
+  # Every label comes from a test, so no group is empty
+  maxima = np.maximum.reduceat( values[order], starts )
+  minima = np.minimum.reduceat( values[order], starts )
+  return counts, means, standardDeviations, maxima, minima, order, starts
+
+# Get the name of each of nDimensions dimensions of a results file
+def getParameterNames( filename, nDimensions ):
+  if os.path.splitext( filename )[1] == '.npz':
+    return list( resultsStore.readHeader( filename )['parameterNames'] )
+  return [resultsStore.parameterNames[n] if n < len( resultsStore.parameterNames ) else 'dimension' + str( n ) for n in xrange( nDimensions )]
+
+# Go through the tests in a results file one at a time, yielding each test's parameters (as strings)
+# and the fraction of pieces it did well on.  CSV files are read a row at a time, and results stores a
+# chunk of tests at a time.
+def iterateResults( filename, nDimensions ):
+  if os.path.splitext( filename )[1] == '.npz':
+    header = resultsStore.readHeader( filename )
+    for chunk in resultsStore.iterateChunks( filename, ['codes'] + getScoreNames( header['names'] ) ):
+      for testCodes, accuracy in zip( chunk['codes'], getStoreAccuracies( chunk ) ):
+        yield [str( dimensionLabels[code] ) for dimensionLabels, code in zip( header['labels'], testCodes )], accuracy
+  else:
+    with open( filename, 'rb' ) as csvfile:
+      for row in csv.reader( csvfile, delimiter=',' ):
+        yield row[:nDimensions], float( row[-1] )
+
+# Summarize results in a single pass, keeping running statistics and a histogram (over [0, 1]) of the
+# accuracies for each value of each dimension.  Returns a list with a dict for each dimension, of
+# value -> (RunningStatistics, histogram).
+def summarizeResults( results, nBins=50 ):
+  summaries = []
+  for parameters, accuracy in results:
+    if len( summaries ) == 0:
+      summaries = [collections.OrderedDict() for parameter in parameters]
+    for summary, value in zip( summaries, parameters ):
+      if value not in summary:
+        summary[value] = (runningStatistics.RunningStatistics(), np.zeros( nBins, dtype=np.int ))
+      statistics, histogram = summary[value]
+      statistics.add( accuracy )
+      histogram[np.clip( int( accuracy*nBins ), 0, nBins - 1 )] += 1
+  return summaries
+
+# Get a dict of the statistics of each value of each dimension, for reporting
+def getReport( summaries, parameterNames ):
+  report = collections.OrderedDict()
+  for parameterName, summary in zip( parameterNames, summaries ):
+    report[parameterName] = collections.OrderedDict()
+    for value, (statistics, histogram) in summary.items():
+      report[parameterName][value] = collections.OrderedDict( [('count', statistics.count), ('mean', statistics.mean), ('std', statistics.getStandardDeviation()), ('min', statistics.minimum), ('max', statistics.maximum)] + [('q' + str( q ), statistics.getQuantile( q )) for q in reportQuantiles] )
+  return report
+
+def printReport( report ):
+  for parameterName, values in report.items():
+    print parameterName
+    print "{:>20} {:>8} {:>8} {:>8} {:>8} {:>8}".format( 'Value', 'Count', 'Mean', 'Std', 'Min', 'Max' ) + ''.join( ["{:>8}".format( 'q' + str( q ) ) for q in reportQuantiles] )
+    for value, statistics in values.items():
+      print "{:>20} {:>8d}".format( value, statistics['count'] ) + ''.join( ["{:>8.4f}".format( statistic ) for name, statistic in statistics.items()[1:]] )
+
+# Render the histogram of each dimension's values, and a box plot of them from their quantiles, to
+# PNG files in plotDirectory
+def savePlots( summaries, parameterNames, plotDirectory ):
+  import matplotlib.pyplot as plt
+  if not os.path.exists( plotDirectory ):
+    os.makedirs( plotDirectory )
+  for parameterName, summary in zip( parameterNames, summaries ):
+    nValues = np.ceil(len(summary)/2.0)
+    figure = plt.figure()
+    tallestBin = max( [np.max( histogram ) for statistics, histogram in summary.values()] )
+    for m, (value, (statistics, histogram)) in enumerate( summary.items() ):
+      axis = figure.add_subplot( 2, nValues, m + 1 )
+      axis.bar( np.arange( histogram.shape[0] )/(1.0*histogram.shape[0]), histogram, width=1.0/histogram.shape[0], align='edge' )
+      axis.axis( [0, 1, 0, tallestBin] )
+      axis.set_title( value )
+    figure.savefig( os.path.join( plotDirectory, parameterName + '-histograms.png' ) )
+    plt.close( figure )
+    # Whiskers at the extremes, as in the interactive box plots
+    boxes = [{'label': value, 'med': 100*statistics.getQuantile( 0.5 ), 'q1': 100*statistics.getQuantile( 0.25 ), 'q3': 100*statistics.getQuantile( 0.75 ), 'whislo': 100*statistics.minimum, 'whishi': 100*statistics.maximum, 'fliers': []} for value, (statistics, histogram) in summary.items()]
+    figure = plt.figure()
+    axis = figure.add_subplot( 111 )
+    axis.bxp( boxes )
+    axis.set_xlabel( parameterName )
+    axis.set_ylabel( 'Percent of pieces' )
+    figure.savefig( os.path.join( plotDirectory, parameterName + '-boxplot.png' ) )
+    plt.close( figure )
+
+# Parse the command line arguments into the results file, nDimensions, the report format (None for the
+# interactive plots) and the plot directory.  nDimensions is optional for results stores, where it's
+# ignored.  Returns None if the arguments don't make sense.
+def parseArguments( arguments ):
+  if len( arguments ) < 1:
+    return None
+  filename, arguments = arguments[0], list( arguments[1:] )
+  nDimensions = None
+  if len( arguments ) > 0 and arguments[0].isdigit():
+    nDimensions = int( arguments.pop( 0 ) )
+  elif os.path.splitext( filename )[1] != '.npz':
+    return None
+  reportFormat = None
+  if len( arguments ) > 0 and arguments[0] in ['text', 'json']:
+    reportFormat = arguments.pop( 0 )
+  plotDirectory = None
+  if reportFormat is not None and len( arguments ) > 0:
+    plotDirectory = arguments.pop( 0 )
+  if len( arguments ) > 0:
+    return None
+  return filename, nDimensions, reportFormat, plotDirectory
 
 if __name__ == "__main__":
-  if len(sys.argv) < 3:
-    print "Usage: %s gridSearchResults.csv nDimensions" % sys.argv[0]
+  parsedArguments = parseArguments( sys.argv[1:] )
+  if parsedArguments is None:
+    print "Usage: %s gridSearchResults.csv nDimensions [text|json] [plotDirectory]" % sys.argv[0]
+    print "       %s gridSearchResults.npz [nDimensions] [text|json] [plotDirectory]" % sys.argv[0]
+    print "Giving a report format summarizes the results in one pass without opening any windows, and"
+    print "only plots when a directory to save the plots in is given.  nDimensions is ignored for .npz files."
     sys.exit(-1)
+  filename, nDimensions, reportFormat, plotDirectory = parsedArguments
   
-  nDimensions = int(sys.argv[2])
+  if reportFormat is not None:
+    if plotDirectory is not None:
+      # Plots are only rendered to files
+      matplotlib.use( 'Agg' )
+    parameterNames = getParameterNames( filename, nDimensions )
+    summaries = summarizeResults( iterateResults( filename, nDimensions ) )
+    report = getReport( summaries, parameterNames )
+    if reportFormat == 'json':
+      print json.dumps( report, indent=1 )
+    else:
+      printReport( report )
+    if plotDirectory is not None:
+      savePlots( summaries, parameterNames, plotDirectory )
+    sys.exit(0)
 
+  import matplotlib.pyplot as plt
+  if os.path.splitext( filename )[1] == '.npz':
+    codes, parameterLabels, testAccuracies = readStoreResults( filename )
+  else:
+    codes, parameterLabels, testAccuracies = readCSVResults( filename, nDimensions )
+  nDimensions = codes.shape[1]
+
+  # The accuracies for each value of each dimension
   gridSearchResults = []
   for n in xrange( nDimensions ):
-    gridSearchResults += [collections.defaultdict(list)]
-  
-  with open(sys.argv[1], 'rb') as csvfile:
-    spamreader = csv.reader(csvfile, delimiter=',')
-    for row in spamreader:
-      for n in xrange( nDimensions ):
-        gridSearchResults[n][row[n]] += [float(row[-1])]
+    counts, means, standardDeviations, maxima, minima, order, starts = getGroupStatistics( codes[:, n], testAccuracies, parameterLabels[n].shape[0] )
+    ends = np.append( starts[1:], order.shape[0] )
+    gridSearchResults += [collections.OrderedDict( (parameterLabels[n][m], testAccuracies[order[starts[m]:ends[m]]]) for m in xrange( parameterLabels[n].shape[0] ) )]
+    for value, mean, standardDeviation, maximum, minimum in zip( parameterLabels[n], means, standardDeviations, maxima, minima ):
+      print value, '->', mean, standardDeviation, maximum, minimum
 
   for n in xrange( nDimensions ):
     labels = []
@@ -41,7 +225,6 @@ if __name__ == "__main__":
       if np.max( binCounts ) > tallestBin:
         tallestBin = np.max( binCounts )
       plt.title( value )
-      print value, '->', np.mean( accuracies ), np.std(accuracies), np.max(accuracies), np.min( accuracies )
     for axis in axes:
       axis.axis( [0, 1, 0, tallestBin] )
     #plt.legend( labels )
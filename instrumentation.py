@@ -0,0 +1,138 @@
+# instrumentation.py
+# Per-stage wall time, call counts and bytes processed, along with counters (like cache hits and misses),
+# for finding out where a grid search spends its time.  Each timed stage can also be logged as a JSON
+# line, and a summary table printed at the end of a run.
+#
+# Instrumentation is off unless enable() is called or the SYNCHRONIZATION_INSTRUMENTATION environment
+# variable is set to the file to write JSON lines to.  When it's off, stage() and count() do nothing.
+
+import numpy as np
+import os
+import json
+import time
+import collections
+
+enabled = False
+# File JSON lines are appended to, or None to only keep the totals
+logFilename = None
+# Open log file and the process it was opened in, so that forked workers open their own
+logFile = None
+logProcess = None
+# Totals for this process: stage name -> [calls, seconds, bytes], and counter name -> count
+stageTotals = collections.defaultdict( lambda: [0, 0.0, 0] )
+counters = collections.defaultdict( int )
+
+def enable( filename=None ):
+  global enabled, logFilename
+  enabled = True
+  logFilename = filename
+
+def disable():
+  global enabled
+  enabled = False
+
+def isEnabled():
+  return enabled
+
+# Write one JSON line to the log, if there is one
+def log( record ):
+  global logFile, logProcess
+  if logFilename is None:
+    return
+  if logFile is None or logProcess != os.getpid():
+    logFile = open( logFilename, 'a' )
+    logProcess = os.getpid()
+  logFile.write( json.dumps( record ) + '\n' )
+  logFile.flush()
+
+# Total size of the arrays in a stage's inputs, which may be arrays or nested tuples and lists of them
+def getBytes( inputs ):
+  if isinstance( inputs, np.ndarray ):
+    return inputs.nbytes
+  if isinstance( inputs, (tuple, list) ):
+    return sum( [getBytes( item ) for item in inputs] )
+  return 0
+
+# Times the code run in a with block, adding it to the stage's totals
+class StageTimer:
+  def __init__( self, name ):
+    self.name = name
+    self.bytes = 0
+
+  def __enter__( self ):
+    self.startTime = time.time()
+    return self
+
+  # Record the inputs of the stage, to count the bytes it processed.  Stages which read their input
+  # from disk (like decoding) have no inputs to count.
+  def addInputs( self, inputs ):
+    self.bytes += getBytes( inputs )
+
+  def __exit__( self, exceptionType, exceptionValue, traceback ):
+    seconds = time.time() - self.startTime
+    totals = stageTotals[self.name]
+    totals[0] += 1
+    totals[1] += seconds
+    totals[2] += self.bytes
+    log( {'event': 'stage', 'stage': self.name, 'seconds': seconds, 'bytes': self.bytes, 'pid': os.getpid(), 'time': self.startTime} )
+    return False
+
+# Stands in for StageTimer when instrumentation is off
+class NoStageTimer:
+  def __enter__( self ):
+    return self
+
+  def addInputs( self, inputs ):
+    pass
+
+  def __exit__( self, exceptionType, exceptionValue, traceback ):
+    return False
+
+noStageTimer = NoStageTimer()
+
+# Get a context manager which times the stage run in its with block
+def stage( name ):
+  if not enabled:
+    return noStageTimer
+  return StageTimer( name )
+
+# Add to a counter
+def count( name, n=1 ):
+  if enabled:
+    counters[name] += n
+
+# Get this process's totals, in a form which can be sent between processes and merged with mergeStats
+def getStats():
+  return {'stages': dict( (name, list( totals )) for name, totals in stageTotals.items() ), 'counters': dict( counters )}
+
+def resetStats():
+  stageTotals.clear()
+  counters.clear()
+
+# Add the totals in stats to those in totalStats, returning totalStats
+def mergeStats( totalStats, stats ):
+  totalStats.setdefault( 'stages', {} )
+  totalStats.setdefault( 'counters', {} )
+  for name, totals in stats['stages'].items():
+    previousTotals = totalStats['stages'].get( name, [0, 0.0, 0] )
+    totalStats['stages'][name] = [previous + new for previous, new in zip( previousTotals, totals )]
+  for name, n in stats['counters'].items():
+    totalStats['counters'][name] = totalStats['counters'].get( name, 0 ) + n
+  return totalStats
+
+# Print a table of the time spent in each stage, and the counters, and log them as a summary line
+def printSummary( stats=None ):
+  if stats is None:
+    stats = getStats()
+  stages = stats.get( 'stages', {} )
+  totalSeconds = sum( [seconds for calls, seconds, nBytes in stages.values()] )
+  print "{:>24} {:>10} {:>12} {:>12} {:>12} {:>8}".format( 'Stage', 'Calls', 'Seconds', 'ms/call', 'MB', '% time' )
+  # Most expensive stages first
+  for name, (calls, seconds, nBytes) in sorted( stages.items(), key=lambda item: -item[1][1] ):
+    print "{:>24} {:>10d} {:>12.3f} {:>12.3f} {:>12.1f} {:>8.1f}".format( name, calls, seconds, 1000.0*seconds/max( calls, 1 ), nBytes/2.0**20, 100.0*seconds/max( totalSeconds, 1e-10 ) )
+  for name, n in sorted( stats.get( 'counters', {} ).items() ):
+    print "{:>24} {:>10d}".format( name, n )
+  log( {'event': 'summary', 'stages': stages, 'counters': stats.get( 'counters', {} ), 'pid': os.getpid(), 'time': time.time()} )
+
+if os.environ.get( 'SYNCHRONIZATION_INSTRUMENTATION' ):
+  enable( os.environ['SYNCHRONIZATION_INSTRUMENTATION'] )
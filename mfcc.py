@@ -5,6 +5,8 @@
 
 import numpy as np
 import scipy.signal as signal
+import scipy.sparse
+import collections
 
 def nextpow2(i):
   n = 1
@@ -12,29 +14,59 @@ def nextpow2(i):
     n = n * 2
   return n
 
-filters = np.zeros((0, 0))
+# Filterbank and DCT matrices are shared between MFCC objects with the same parameters.
+# The least recently used ones are dropped once there are more than maxCachedMatrices.
+maxCachedMatrices = 32
+cachedMatrices = collections.OrderedDict()
+
+def getCachedMatrix( key, computeMatrix ):
+  if key in cachedMatrices:
+    matrix = cachedMatrices.pop( key )
+  else:
+    matrix = computeMatrix()
+  # Most recently used matrices are at the end
+  cachedMatrices[key] = matrix
+  while len( cachedMatrices ) > maxCachedMatrices:
+    cachedMatrices.popitem( last=False )
+  return matrix
 
 class MFCC:
-  def __init__( self, fs, N, nFilters=40.0, nCC = 13.0 ):
+  # When sparse is set, the filterbank is stored as a sparse matrix, which makes the mel projection
+  # cheaper since each filter only covers a handful of bins.
+  def __init__( self, fs, N, nFilters=40.0, nCC = 13.0, lowerFreq=0, upperFreq=None, sparse=False ):
     self.nFilters = nFilters
     self.nCC = nCC
-    self.filters = self.getFilters( N, fs )
+    self.sparse = sparse
+    if sparse:
+      # Transposed, so it can be multiplied by power spectra arranged as columns
+      self.filters = getCachedMatrix( ('sparseFilters', fs, N, nFilters, lowerFreq, upperFreq), lambda: scipy.sparse.csr_matrix( self.getFilters( N, fs, lowerFreq, upperFreq ).T ) )
+    else:
+      self.filters = getCachedMatrix( ('filters', fs, N, nFilters, lowerFreq, upperFreq), lambda: self.getFilters( N, fs, lowerFreq, upperFreq ) )
+    self.s2dct = getCachedMatrix( ('s2dct', nFilters, nCC), self.s2dctmat )
   
   def getMelSpectrum( self, spectrum ):
-    powerSpectrum = spectrum.real*spectrum.real + spectrum.imag*spectrum.imag
-    return np.dot(powerSpectrum, self.filters)
+    return self.getMelSpectrumFromPower( spectrum.real*spectrum.real + spectrum.imag*spectrum.imag )
+
+  # Get the mel spectrum from a power spectrum which has already been computed
+  def getMelSpectrumFromPower( self, powerSpectrum ):
+    if self.sparse:
+      # Sparse products need 2D arrays, so flatten any leading axes
+      flatPowerSpectrum = powerSpectrum.reshape( -1, powerSpectrum.shape[-1] )
+      melSpectrum = self.filters.dot( flatPowerSpectrum.T ).T.astype( powerSpectrum.dtype, copy=False )
+      return melSpectrum.reshape( powerSpectrum.shape[:-1] + (melSpectrum.shape[-1],) )
+    # Keep the precision of the spectrum
+    return np.dot(powerSpectrum, np.asarray( self.filters, dtype=powerSpectrum.dtype ))
   
   def getMFCC( self, spectrum ):
     melSpectrum = self.getMelSpectrum( spectrum )
     # This could be optional
     logMelSpectrum = np.log( melSpectrum.clip(1e-5,np.inf) )
-    s2dct = self.s2dctmat()
     # Calculate MFCCs and return them
-    return np.dot(logMelSpectrum, s2dct.T)/self.nCC
+    return np.dot(logMelSpectrum, self.s2dct.T)/self.nCC
 
   def getFilters( self, N, fs, lowerFreq=0, upperFreq=None ):
     # Build mel filter matrix
-    filters = np.zeros((N/2 + 1, self.nFilters), 'd')
+    filters = np.zeros((N/2 + 1, int(self.nFilters)), 'd')
     dFreq = fs/(1.0*N)
     if upperFreq > fs/2 or upperFreq is None:
       #raise(Exception, "Upper frequency exceeds Nyquist")
@@ -45,11 +77,11 @@ class MFCC:
     # Filter edges, in Hz
     filterEdges = self.melinv(melMin + dmelBandwidth*np.arange(self.nFilters + 2, dtype='d'))
     
-    for whichfilt in np.arange(0, self.nFilters):
+    for whichfilt in xrange(int(self.nFilters)):
       # Filter triangles, in DFT points
-      leftFreq = np.round(filterEdges[whichfilt]/dFreq)
-      centerFreq = np.round(filterEdges[whichfilt + 1]/dFreq)
-      rightFreq = np.round(filterEdges[whichfilt + 2]/dFreq)
+      leftFreq = int(np.round(filterEdges[whichfilt]/dFreq))
+      centerFreq = int(np.round(filterEdges[whichfilt + 1]/dFreq))
+      rightFreq = int(np.round(filterEdges[whichfilt + 2]/dFreq))
       # For some reason this is calculated in Hz, though I think
       # it doesn't really matter
       fWidth = (rightFreq - leftFreq)*dFreq
@@ -74,8 +106,8 @@ class MFCC:
   
   # Get the DCT matrix for calculating the DCT
   def s2dctmat(self):
-    melcos = np.empty((self.nCC, self.nFilters), 'double')
-    for i in np.arange(0,self.nCC):
+    melcos = np.empty((int(self.nCC), int(self.nFilters)), 'double')
+    for i in xrange(int(self.nCC)):
       freq = np.pi*float(i)/self.nFilters
       melcos[i] = np.cos(freq * np.arange(0.5, float(self.nFilters)+0.5, 1.0, 'double'))
     melcos[:,0] = melcos[:,0] * 0.5
@@ -5,12 +5,31 @@
 
 import numpy as np
 import mfcc
+import cache
 #import scipy.signal as signal
 
+# The ODFs whose kernels also accept a stack of spectrograms, shaped (files x frames x bins)
+batchableODFs = ['HFCMasri', 'HFCJensen', 'HFCMasriBello', 'spectralDistance', 'complex', 'phase', 'KLDivergence', 'melDifference']
+
 class ODF:
+  # Pass None as the onsetDetectionAlgorithm to skip computing an ODF.  The ODF is cached when caching is
+  # enabled and the spectrogram's cache key is passed as cacheKey.
   def __init__( self, spectrogram, onsetDetectionAlgorithm, **kwargs ):
+    cacheKey = kwargs.pop( 'cacheKey', None )
     self.spectrogram = spectrogram
-    self.onsetDetectionFunction = onsetDetectionAlgorithm( self, **kwargs )
+    # Real type matching the spectrogram's precision, which the ODFs are computed in
+    self.realType = np.zeros( 0, dtype=spectrogram.dtype ).real.dtype
+    # Intermediate results, computed on demand and shared between the ODFs
+    self.magnitude = None
+    self.power = None
+    self.unwrappedPhase = None
+    self.dphi = None
+    # Mel spectra, keyed by their parameters
+    self.melSpectra = {}
+    if onsetDetectionAlgorithm is None:
+      self.onsetDetectionFunction = None
+    else:
+      self.onsetDetectionFunction = cache.cachedByKey( lambda: onsetDetectionAlgorithm( self, **kwargs ), getODFCacheKey( cacheKey, onsetDetectionAlgorithm, kwargs ) )
   
   def plotAllOnsetFunctions( self ):
     import matplotlib.pyplot as plt
@@ -28,14 +47,64 @@ class ODF:
       plt.plot( onsetDetectionFunction/np.max(np.abs(onsetDetectionFunction)), color )
     plt.legend( [f.__name__ for f in algorithms] )
     plt.show()
-  
+
+  # Get the magnitude spectrogram, only computing it the first time
+  def getMagnitude( self ):
+    if self.magnitude is None:
+      self.magnitude = np.abs( self.spectrogram )
+    return self.magnitude
+
+  # Get the power spectrogram, only computing it the first time
+  def getPower( self ):
+    if self.power is None:
+      self.power = self.getMagnitude()**2
+    return self.power
+
+  # Get the phase of the spectra, unwrapped along frequency, only computing it the first time
+  def getUnwrappedPhase( self ):
+    if self.unwrappedPhase is None:
+      self.unwrappedPhase = np.unwrap( np.angle( self.spectrogram ), axis=-1 )
+    return self.unwrappedPhase
+
+  # Get the wrapped second difference of the phase over frames, only computing it the first time
+  def getDphi( self ):
+    if self.dphi is None:
+      phi = self.getUnwrappedPhase()
+      # Dphi = princarg( phi[n] - 2*phi[n-1] + phi[n-2] )
+      self.dphi = np.zeros( self.spectrogram.shape, dtype=self.realType )
+      self.dphi[..., 2:, :] = np.mod( phi[..., 2:, :] - 2*phi[..., 1:-1, :] + phi[..., :-2, :] + np.pi, -2*np.pi ) + np.pi
+    return self.dphi
+
+  # Get the mel spectrum from the power spectrogram, only computing it the first time for each set of
+  # parameters
+  def getMelSpectrum( self, fs, sparse=False ):
+    if (fs, sparse) not in self.melSpectra:
+      self.melSpectra[(fs, sparse)] = mfcc.MFCC( fs, 2*(self.spectrogram.shape[-1] - 1), sparse=sparse ).getMelSpectrumFromPower( self.getPower() )
+    return self.melSpectra[(fs, sparse)]
+
+  # The ODFs below which loop over frames have a whole-matrix implementation, used by default.
+  # Pass fast=False to use the original per-frame loops instead.  The whole-matrix implementations
+  # work on the last two axes, so they also accept a stack of spectrograms.
+
   # This doesn't seem to work well.
   def HFCMasri( self, **kwargs ):
     # Equation 3 from "Improved Modelling of Attack Transients in Music Analysis-Resynthesis"
-    HFC = np.zeros( self.spectrogram.shape[0] )
-    DF = np.zeros( self.spectrogram.shape[0] )
+    HFC = np.zeros( self.spectrogram.shape[:-1], dtype=self.realType )
+    DF = np.zeros( self.spectrogram.shape[:-1], dtype=self.realType )
     # Scale for summing frequency bins, with a weighting on high frequencies
-    scale = np.arange( self.spectrogram[0].shape[0] - 1 ) + 2
+    scale = (np.arange( self.spectrogram.shape[-1] - 1 ) + 2).astype( self.realType )
+    if kwargs.get( 'fast', True ):
+      power = self.getPower()[..., 1:]
+      # Calculate high frequency content of all but the first frame
+      HFC[..., 1:] = np.sum( power[..., 1:, :]*scale, axis=-1 )
+      # Denominator for detection function.  This and HFC**2 can overflow single precision, so the
+      # ratio is always formed in double precision.
+      HFC = HFC.astype( np.float64 )
+      denominator = HFC[..., :-1]*np.sum( power[..., 1:, :], axis=-1, dtype=np.float64 )
+      # Denominator should be minimum of 1
+      valid = denominator > 1
+      DF[..., 1:][valid] = (HFC[..., 1:][valid]**2)/denominator[valid]
+      return DF
     for n in np.arange( 1, self.spectrogram.shape[0] ):
       # Get power spectrum
       power = np.abs( self.spectrogram[n][1:] )**2
@@ -52,9 +121,12 @@ class ODF:
 
   def HFCJensen( self, **kwargs ):
     # Equation 3 from "Real-time beat estimation using feature extraction"
-    HFC = np.zeros( self.spectrogram.shape[0] )
+    HFC = np.zeros( self.spectrogram.shape[:-1], dtype=self.realType )
     # Scale for summing frequency bins, with a weighting on high frequencies
-    scale = (np.arange( self.spectrogram[0].shape[0] - 1 ) + 1)**2
+    scale = ((np.arange( self.spectrogram.shape[-1] - 1 ) + 1)**2).astype( self.realType )
+    if kwargs.get( 'fast', True ):
+      HFC[..., 1:] = np.sum( scale*self.getMagnitude()[..., 1:, 1:], axis=-1 )
+      return HFC
     for n in np.arange( 1, self.spectrogram.shape[0] ):
       # Calculate high frequency content
       HFC[n] = np.sum( scale*np.abs( self.spectrogram[n][1:] ) )
@@ -62,9 +134,12 @@ class ODF:
       
   def HFCMasriBello( self, **kwargs ):
     # Equation 4 from "A Tutorial on Onset Detection in Music Signals"
-    HFC = np.zeros( self.spectrogram.shape[0] )
+    HFC = np.zeros( self.spectrogram.shape[:-1], dtype=self.realType )
     # Scale for summing frequency bins, with a weighting on high frequencies
-    scale = np.arange( self.spectrogram[0].shape[0] - 1 ) + 2
+    scale = (np.arange( self.spectrogram.shape[-1] - 1 ) + 2).astype( self.realType )
+    if kwargs.get( 'fast', True ):
+      HFC[..., 1:] = np.sum( scale*self.getMagnitude()[..., 1:, 1:], axis=-1 )
+      return HFC
     for n in np.arange( 1, self.spectrogram.shape[0] ):
       # Calculate high frequency content
       HFC[n] = np.sum( scale*np.abs( self.spectrogram[n][1:] ) )
@@ -72,8 +147,12 @@ class ODF:
       
   def spectralDistance( self, **kwargs ):
     # Equation 7 from "A hybrid approach to musical note onset detection"
-    DM = np.zeros( self.spectrogram.shape[0] )
-    magnitudeSpectrogram = np.abs( self.spectrogram )
+    DM = np.zeros( self.spectrogram.shape[:-1], dtype=self.realType )
+    magnitudeSpectrogram = self.getMagnitude()
+    if kwargs.get( 'fast', True ):
+      difference = np.clip( np.diff( magnitudeSpectrogram, axis=-2 ), 0, np.inf )
+      DM[..., 1:] = np.sum( difference*difference, axis=-1 )
+      return DM
     for n in np.arange( 1, self.spectrogram.shape[0] ):
       difference = magnitudeSpectrogram[n] - magnitudeSpectrogram[n - 1]
       difference = np.clip( difference, 0, np.inf )
@@ -83,33 +162,36 @@ class ODF:
   # Verified working against http://www.mathworks.com/matlabcentral/fileexchange/33451-integrated-stft-istft-onset-detection
   def complex( self, **kwargs ):
     # Eqn 18 from "COMPLEX DOMAIN ONSET DETECTION FOR MUSICAL SIGNALS"
-    # Phi = unwrapped phase of spectra
-    phi = np.unwrap( np.angle( self.spectrogram ), axis=1 )
-    # Dphi = princarg( phi[n] - 2*phi[n-1] + phi[n-2] )
-    dphi = np.zeros( self.spectrogram.shape )
-    dphi[2:,:] = np.mod( phi[2:] - 2*phi[1:-1] + phi[:-2] + np.pi, -2*np.pi ) + np.pi
-    Rhat = np.zeros( self.spectrogram.shape )
-    Rhat[2:,:] = np.abs( self.spectrogram[1:-1] )
-    R = np.zeros( self.spectrogram.shape )
-    R[2:,:] = np.abs( self.spectrogram[2:] )
+    # Dphi = princarg( phi[n] - 2*phi[n-1] + phi[n-2] ), where phi = unwrapped phase of spectra
+    dphi = self.getDphi()
+    Rhat = np.zeros( self.spectrogram.shape, dtype=self.realType )
+    Rhat[..., 2:, :] = self.getMagnitude()[..., 1:-1, :]
+    R = np.zeros( self.spectrogram.shape, dtype=self.realType )
+    R[..., 2:, :] = self.getMagnitude()[..., 2:, :]
     gamma = np.sqrt( np.clip( Rhat**2 + R**2 - 2*Rhat*R*np.cos( dphi ), 0, np.inf ) )
-    return np.sum( gamma, axis = 1 )
+    return np.sum( gamma, axis = -1 )
 
   # I don't think this is working properly.
   def phase( self, **kwargs ):
+    return normalizePhaseODF( self.phaseDeviation( **kwargs ) )
+
+  # The phase ODF before it is normalized
+  def phaseDeviation( self, **kwargs ):
     # Eqn 5 from "A COMBINED PHASE AND AMPLITUDE BASED APPROACH TO ONSET DETECTION FOR AUDIO SEGMENTATION"
-    eta = np.zeros( self.spectrogram.shape[0] )
-    # Phi = unwrapped phase of spectra (don't unwrap)
-    phi = np.unwrap( np.angle( self.spectrogram ), axis=1 )
-    # Dphi = princarg( phi[n] - 2*phi[n-1] + phi[n-2] )
-    dphi = np.zeros( self.spectrogram.shape )
-    dphi[2:] = np.mod( phi[2:] - 2*phi[1:-1] + phi[:-2] + np.pi, -2*np.pi ) + np.pi
+    eta = np.zeros( self.spectrogram.shape[:-1], dtype=self.realType )
+    # Dphi = princarg( phi[n] - 2*phi[n-1] + phi[n-2] ), where phi = unwrapped phase of spectra
+    dphi = self.getDphi()
+    if kwargs.get( 'fast', True ):
+      # Every value in a frame falls within the histogram's [min, max] range, so the mean of the
+      # 1000-bin density histogram is 1/(1000*binWidth) = 1/(max - min), and no binning is needed.
+      absoluteDphi = np.abs( dphi[..., 2:, :] )
+      valueRange = np.max( absoluteDphi, axis=-1 ) - np.min( absoluteDphi, axis=-1 )
+      # np.histogram uses a range of [min - .5, max + .5] when all values are the same
+      valueRange[valueRange == 0] = 1
+      eta[..., 2:] = 1.0/valueRange
+      return eta
     for n in np.arange( 2, self.spectrogram.shape[0] ):
       eta[n] = np.mean( np.histogram( np.abs( dphi[n] ), bins=1000, density=True )[0] )
-    eta[0] = np.median( eta[2:] )
-    eta[1] = eta[0]
-    eta = eta - np.min( eta )
-    eta = eta/np.max( eta )
     '''import matplotlib.pyplot as plt
     plt.imshow( np.abs( dphi.T ), origin='lower', aspect='auto', interpolation='nearest', cmap=plt.cm.gray )
     plt.plot( eta*dphi.shape[1] )
@@ -117,14 +199,73 @@ class ODF:
     return eta
 
   def KLDivergence( self, **kwargs ):
-    KLDivergence = np.zeros( self.spectrogram.shape[0] )
-    magnitudeSpectrogram = np.abs( self.spectrogram )
+    KLDivergence = np.zeros( self.spectrogram.shape[:-1], dtype=self.realType )
+    magnitudeSpectrogram = self.getMagnitude()
     # Calculate KL divergence of successive spectra, and take mean of each spectrum's KL divergence as ODF
-    KLDivergence[1:] = np.mean( magnitudeSpectrogram[1:]*np.log( 1.0 + magnitudeSpectrogram[1:]/(magnitudeSpectrogram[:-1] + 1E-10) ), axis = 1 )
+    KLDivergence[..., 1:] = np.mean( magnitudeSpectrogram[..., 1:, :]*np.log( 1.0 + magnitudeSpectrogram[..., 1:, :]/(magnitudeSpectrogram[..., :-1, :] + 1E-10) ), axis = -1 )
     return KLDivergence
   
-  # DAn's Mel-spectrum difference ODF
+  # DAn's Mel-spectrum difference ODF.  Pass sparse=True to use a sparse mel filterbank.
   def melDifference( self, **kwargs ):
-    fs = kwargs.get( 'fs', 44100 )
-    melSpectrum = mfcc.MFCC( fs, 2*(self.spectrogram.shape[1] - 1) ).getMelSpectrum( self.spectrogram )
-    return np.mean( np.clip( np.diff( np.log( melSpectrum + 1E-10 ), axis=0 ), 0, np.inf ), axis=1 )
\ No newline at end of file
+    melSpectrum = self.getMelSpectrum( kwargs.get( 'fs', 44100 ), kwargs.get( 'sparse', False ) )
+    return np.mean( np.clip( np.diff( np.log( melSpectrum + 1E-10 ), axis=-2 ), 0, np.inf ), axis=-1 )
+
+# Normalize the phase ODF to the range [0, 1] over each ODF's frames
+def normalizePhaseODF( eta ):
+  eta[..., 0] = np.median( eta[..., 2:], axis=-1 )
+  eta[..., 1] = eta[..., 0]
+  eta = eta - np.min( eta, axis=-1 )[..., np.newaxis]
+  eta = eta/np.max( eta, axis=-1 )[..., np.newaxis]
+  return eta
+
+# Compute the ODF of each spectrogram in a list at once, by stacking them into one
+# (files x frames x bins) array.  Shorter spectrograms are padded with silent frames, which doesn't
+# change the ODF of their real frames since each frame's ODF only depends on it and earlier frames.
+# ODFs without a batched kernel are computed one spectrogram at a time.
+def getODFs( spectrograms, onsetDetectionAlgorithm, **kwargs ):
+  return getODFsForAlgorithms( spectrograms, [onsetDetectionAlgorithm], **kwargs )[0]
+
+# Cache key of an ODF, given the cache key of its spectrogram
+def getODFCacheKey( cacheKey, onsetDetectionAlgorithm, kwargs ):
+  return cache.getChildKey( 'ODF', cacheKey, onsetDetectionAlgorithm.__name__, sorted( kwargs.items() ) )
+
+# Compute the ODFs of each spectrogram in a list for each of several algorithms, as in getODFs.
+# All of the algorithms share one stacked spectrogram, so intermediate results like the magnitude
+# and phase are only computed once.  Returns a list of ODFs for each algorithm.  The ODFs are cached
+# when caching is enabled and the spectrograms' cache keys are passed as cacheKeys.
+def getODFsForAlgorithms( spectrograms, onsetDetectionAlgorithms, **kwargs ):
+  cacheKeys = kwargs.pop( 'cacheKeys', [None]*len( spectrograms ) )
+  # Stacked spectrograms which haven't had every ODF retrieved from the cache, created when needed
+  stacked = None
+  allODFs = []
+  for onsetDetectionAlgorithm in onsetDetectionAlgorithms:
+    if onsetDetectionAlgorithm.__name__ not in batchableODFs:
+      allODFs.append( [ODF( spectrogram, onsetDetectionAlgorithm, cacheKey=cacheKey, **kwargs ).onsetDetectionFunction for spectrogram, cacheKey in zip( spectrograms, cacheKeys )] )
+      continue
+    # Get any ODFs which were already computed from the cache, under the same key ODF uses
+    keys = [getODFCacheKey( cacheKey, onsetDetectionAlgorithm, kwargs ) for cacheKey in cacheKeys]
+    ODFs = [cache.load( key ) if key is not None else None for key in keys]
+    if any( [output is None for output in ODFs] ):
+      if stacked is None:
+        nFrames = [spectrogram.shape[0] for spectrogram in spectrograms]
+        # Stack the spectrograms, padded to the same number of frames
+        stack = np.zeros( (len( spectrograms ), max( nFrames ), spectrograms[0].shape[1]), dtype=spectrograms[0].dtype )
+        for n, spectrogram in enumerate( spectrograms ):
+          stack[n, :nFrames[n]] = spectrogram
+        stacked = ODF( stack, None )
+      if onsetDetectionAlgorithm.__name__ == 'phase':
+        # The phase ODF is normalized over all of its frames, which mustn't include the padding
+        stackedODFs = stacked.phaseDeviation( **kwargs )
+      else:
+        stackedODFs = onsetDetectionAlgorithm( stacked, **kwargs )
+      for n in xrange( len( spectrograms ) ):
+        if ODFs[n] is not None:
+          continue
+        # Some ODFs are shorter than the spectrogram, so trim by the amount of padding
+        ODFs[n] = stackedODFs[n, :stackedODFs.shape[1] - (max( nFrames ) - nFrames[n])]
+        if onsetDetectionAlgorithm.__name__ == 'phase':
+          ODFs[n] = normalizePhaseODF( ODFs[n] )
+        if keys[n] is not None:
+          cache.store( keys[n], ODFs[n] )
+    allODFs.append( ODFs )
+  return allODFs
@@ -0,0 +1,60 @@
+# precisionReport.py
+# Compare grid search results computed in single precision against the same grid search in
+# double precision, to check that single precision doesn't change which parameters come out on top
+#
+# Usage: precisionReport.py doublePrecisionResults.csv singlePrecisionResults.csv nDimensions
+
+import sys
+import csv
+import numpy as np
+import scipy.stats
+
+# Read a grid search CSV into a dict of parameters -> numeric result columns.
+# Cells which aren't numbers (like the continuous grid search's arrays) are skipped.
+def readResults( filename, nDimensions ):
+  results = {}
+  with open( filename, 'rb' ) as csvfile:
+    for row in csv.reader( csvfile ):
+      values = []
+      for cell in row[nDimensions:]:
+        try:
+          values.append( float( cell ) )
+        except ValueError:
+          pass
+      results[tuple( row[:nDimensions] )] = values
+  return results
+
+# Compare the rankings two sets of results give the parameters, using one result column
+def compareRankings( doubleValues, singleValues, nTop=10 ):
+  spearman = scipy.stats.spearmanr( doubleValues, singleValues )[0]
+  kendall = scipy.stats.kendalltau( doubleValues, singleValues )[0]
+  # Descending order, so the best parameters come first
+  doubleOrder = np.argsort( -doubleValues, kind='mergesort' )
+  singleOrder = np.argsort( -singleValues, kind='mergesort' )
+  nTop = min( nTop, doubleValues.shape[0] )
+  topOverlap = len( set( doubleOrder[:nTop] ) & set( singleOrder[:nTop] ) )/(1.0*nTop)
+  return spearman, kendall, doubleOrder[0] == singleOrder[0], topOverlap
+
+if __name__ == "__main__":
+  if len(sys.argv) < 4:
+    print "Usage: %s doublePrecisionResults.csv singlePrecisionResults.csv nDimensions" % sys.argv[0]
+    sys.exit(-1)
+
+  nDimensions = int(sys.argv[3])
+  doubleResults = readResults( sys.argv[1], nDimensions )
+  singleResults = readResults( sys.argv[2], nDimensions )
+
+  parameters = sorted( set( doubleResults ) & set( singleResults ) )
+  print "{} parameter settings in common ({} only in double, {} only in single precision)".format( len( parameters ), len( set( doubleResults ) - set( singleResults ) ), len( set( singleResults ) - set( doubleResults ) ) )
+  if len( parameters ) == 0:
+    sys.exit(-1)
+
+  doubleValues = np.array( [doubleResults[parameter] for parameter in parameters] )
+  singleValues = np.array( [singleResults[parameter] for parameter in parameters] )
+
+  print "Column  max abs diff  max rel diff  spearman  kendall  same best  top 10 overlap"
+  for column in xrange( doubleValues.shape[1] ):
+    difference = np.abs( doubleValues[:, column] - singleValues[:, column] )
+    relativeDifference = difference/np.maximum( np.abs( doubleValues[:, column] ), 1e-30 )
+    spearman, kendall, sameBest, topOverlap = compareRankings( doubleValues[:, column], singleValues[:, column] )
+    print "{:6d}  {:12.3e}  {:12.3e}  {:8.4f}  {:7.4f}  {:>9}  {:14.2f}".format( column + nDimensions, np.max( difference ), np.max( relativeDifference ), spearman, kendall, str( sameBest ), topOverlap )
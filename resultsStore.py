@@ -0,0 +1,73 @@
+# resultsStore.py
+# Columnar binary store for grid search results, saved as a .npz file.  Each parameter is stored as
+# an array of integer codes into an array of its distinct values (labels), and the raw scores for each
+# test and directory are stored as numeric arrays, so results can be grouped without parsing text.
+
+import numpy as np
+import zipfile
+
+# Names of the parameters of a grid search test, in the order they appear in the results
+parameterNames = ['ODF', 'downsamplingFactor', 'frameSize', 'hopSizeScale', 'window', 'offset']
+
+# Write results to a store.  parameters is a list of the tests' parameter tuples, and each of the
+# score arrays has one row per test (with one column per directory, in the order of directories).
+def writeResults( filename, parameters, directories, **scores ):
+  arrays = {'parameterNames': np.array( parameterNames ), 'directories': np.array( directories )}
+  codes = np.zeros( (len( parameters ), len( parameterNames )), dtype=np.int32 )
+  for n in xrange( len( parameterNames ) ):
+    labels, codes[:, n] = np.unique( [testParameters[n] for testParameters in parameters], return_inverse=True )
+    arrays['labels' + str( n )] = labels
+  arrays['codes'] = codes
+  for name, score in scores.items():
+    arrays[name] = np.asarray( score )
+  np.savez( filename, **arrays )
+
+# Read a store into a dict with the parameter names, codes (tests x parameters), a list of each
+# parameter's labels, the directories and each score array
+def readResults( filename ):
+  store = np.load( filename )
+  results = dict( (name, store[name]) for name in store.files if not name.startswith( 'labels' ) )
+  results['labels'] = [store['labels' + str( n )] for n in xrange( results['parameterNames'].shape[0] )]
+  return results
+
+# Read a store's parameter names, labels and directories, and the names of its arrays, without reading
+# the codes or scores
+def readHeader( filename ):
+  store = np.load( filename )
+  header = {'parameterNames': store['parameterNames'], 'directories': store['directories'], 'names': store.files}
+  header['labels'] = [store['labels' + str( n )] for n in xrange( header['parameterNames'].shape[0] )]
+  return header
+
+# Read the header of an array in a .npy file, returning its shape, whether it's in Fortran order and
+# its dtype
+def readArrayHeader( f ):
+  version = np.lib.format.read_magic( f )
+  if version == (1, 0):
+    return np.lib.format.read_array_header_1_0( f )
+  return np.lib.format.read_array_header_2_0( f )
+
+# Go through some of a store's arrays which have a row per test (the codes and scores) chunkSize rows
+# at a time, without reading the whole arrays.  Yields a dict of each array's rows.
+def iterateChunks( filename, names, chunkSize=2**12 ):
+  with zipfile.ZipFile( filename ) as store:
+    files = [store.open( name + '.npy' ) for name in names]
+    headers = [readArrayHeader( f ) for f in files]
+    arrays = []
+    for f, (shape, fortranOrder, dtype) in zip( files, headers ):
+      if fortranOrder:
+        # Rows aren't contiguous, so the whole array has to be read
+        arrays.append( np.frombuffer( f.read(), dtype=dtype ).reshape( shape, order='F' ) )
+      else:
+        arrays.append( None )
+    nTests = headers[0][0][0]
+    for start in xrange( 0, nTests, chunkSize ):
+      nRows = min( chunkSize, nTests - start )
+      chunk = {}
+      for name, f, (shape, fortranOrder, dtype), array in zip( names, files, headers, arrays ):
+        if array is not None:
+          chunk[name] = array[start:start + nRows]
+        else:
+          rowShape = tuple( shape[1:] )
+          nBytes = nRows*int( np.prod( rowShape ) )*dtype.itemsize
+          chunk[name] = np.frombuffer( f.read( nBytes ), dtype=dtype ).reshape( (nRows,) + rowShape )
+      yield chunk
@@ -0,0 +1,113 @@
+# runningStatistics.py
+# Statistics which are updated one value at a time, so that large result files can be summarized in
+# a single pass without keeping the values around.  Both classes can be merged, so summaries computed
+# separately (for example, in different processes) can be combined.
+
+import numpy as np
+import collections
+
+# Approximate quantiles, in the style of DDSketch: values are counted in logarithmically spaced
+# buckets, so that any quantile is returned to within relativeAccuracy of the true value's magnitude.
+# Values with magnitude below minValue are counted as zero.
+class QuantileSketch:
+  def __init__( self, relativeAccuracy=0.01, minValue=1e-9 ):
+    self.relativeAccuracy = relativeAccuracy
+    self.minValue = minValue
+    self.gamma = (1 + relativeAccuracy)/(1 - relativeAccuracy)
+    self.logGamma = np.log( self.gamma )
+    # Counts of positive values and negative values (by magnitude) in each bucket
+    self.positiveBuckets = collections.defaultdict( int )
+    self.negativeBuckets = collections.defaultdict( int )
+    self.zeroCount = 0
+    self.count = 0
+
+  # Bucket a magnitude falls in
+  def getBucket( self, magnitude ):
+    return int( np.ceil( np.log( magnitude )/self.logGamma ) )
+
+  # Value representing a bucket, within relativeAccuracy of every magnitude in it
+  def getBucketValue( self, bucket ):
+    return 2*self.gamma**bucket/(self.gamma + 1)
+
+  def add( self, value ):
+    self.count += 1
+    if value > self.minValue:
+      self.positiveBuckets[self.getBucket( value )] += 1
+    elif value < -self.minValue:
+      self.negativeBuckets[self.getBucket( -value )] += 1
+    else:
+      self.zeroCount += 1
+
+  def merge( self, other ):
+    for bucket, count in other.positiveBuckets.items():
+      self.positiveBuckets[bucket] += count
+    for bucket, count in other.negativeBuckets.items():
+      self.negativeBuckets[bucket] += count
+    self.zeroCount += other.zeroCount
+    self.count += other.count
+
+  # Get the approximate value at quantile q (between 0 and 1), or nan if nothing has been added
+  def getQuantile( self, q ):
+    if self.count == 0:
+      return np.nan
+    rank = q*(self.count - 1)
+    seen = 0
+    # Go through the buckets from the most negative value to the most positive
+    for bucket in sorted( self.negativeBuckets, reverse=True ):
+      seen += self.negativeBuckets[bucket]
+      if seen > rank:
+        return -self.getBucketValue( bucket )
+    seen += self.zeroCount
+    if seen > rank:
+      return 0.0
+    for bucket in sorted( self.positiveBuckets ):
+      seen += self.positiveBuckets[bucket]
+      if seen > rank:
+        return self.getBucketValue( bucket )
+    return self.getBucketValue( max( self.positiveBuckets ) )
+
+# Count, mean, variance (using Welford's algorithm), minimum, maximum and approximate quantiles of a
+# stream of values
+class RunningStatistics:
+  def __init__( self, relativeAccuracy=0.01 ):
+    self.count = 0
+    self.mean = 0.0
+    # Sum of squared differences from the mean
+    self.M2 = 0.0
+    self.minimum = np.inf
+    self.maximum = -np.inf
+    self.sketch = QuantileSketch( relativeAccuracy )
+
+  def add( self, value ):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta/self.count
+    self.M2 += delta*(value - self.mean)
+    self.minimum = min( self.minimum, value )
+    self.maximum = max( self.maximum, value )
+    self.sketch.add( value )
+
+  def merge( self, other ):
+    if other.count == 0:
+      return
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.mean += delta*other.count/count
+    self.M2 += other.M2 + delta*delta*self.count*other.count/count
+    self.count = count
+    self.minimum = min( self.minimum, other.minimum )
+    self.maximum = max( self.maximum, other.maximum )
+    self.sketch.merge( other.sketch )
+
+  # Population variance, like np.var
+  def getVariance( self ):
+    if self.count == 0:
+      return np.nan
+    return self.M2/self.count
+
+  def getStandardDeviation( self ):
+    return np.sqrt( self.getVariance() )
+
+  # The sketch's approximate quantile, which can't be outside the range of the values seen
+  def getQuantile( self, q ):
+    return np.clip( self.sketch.getQuantile( q ), self.minimum, self.maximum )
@@ -12,22 +12,235 @@ def padOrTruncate( array, size ):
   if array.shape[0] > size:
     return array[:size]
   else:
-    return np.append( array, np.zeros( size - array.shape[0] ) )
+    return np.append( array, np.zeros( size - array.shape[0], dtype=array.dtype ) )
+
+# Correlation of x and y for lags 0 through maxLag, i.e. correlation[k] = sum_n x[n + k]*y[n],
+# with x treated as zero past its end.  method is 'direct', which only computes the lags needed,
+# 'fft', or 'auto', which picks whichever should be faster.
+def boundedCorrelation( x, y, maxLag, method='auto' ):
+  nLags = maxLag + 1
+  # Smallest power of 2 FFT size for which the circular correlation doesn't wrap at these lags
+  fftSize = int( 2**np.ceil( np.log2( max( x.shape[0], y.shape[0] + maxLag, 1 ) ) ) )
+  if method == 'auto':
+    # Rough operation counts - a direct dot product per lag, or three FFTs
+    if nLags*y.shape[0] < 3*fftSize*np.log2( fftSize ):
+      method = 'direct'
+    else:
+      method = 'fft'
+  if method == 'direct':
+    correlation = np.zeros( nLags, dtype=np.result_type( x.dtype, y.dtype ) )
+    for lag in xrange( nLags ):
+      # Number of terms which overlap at this lag
+      n = min( y.shape[0], x.shape[0] - lag )
+      if n > 0:
+        correlation[lag] = np.dot( x[lag:lag + n], y[:n] )
+    return correlation
+  elif method == 'fft':
+    correlation = np.fft.irfft( np.fft.rfft( x, fftSize )*np.conj( np.fft.rfft( y, fftSize ) ), fftSize )[:nLags]
+    # numpy's FFT works in double precision, so return to the precision of the ODFs
+    return correlation.astype( np.result_type( x.dtype, y.dtype ), copy=False )
+  else:
+    raise ValueError( "Unknown correlation method %s" % method )
+
+# Get the peak of correlations over lags (their last axis) and the lag where it occurs.  Ties go to the
+# lag smallest in magnitude, and when the peak is as high at a lag as at its negation, the lag is
+# ambiguous and 0 is given.
+def getPeaks( correlations, lags ):
+  peaks = np.max( correlations, axis=-1 )
+  isPeak = correlations == peaks[..., np.newaxis]
+  peakMagnitudes = np.min( np.where( isPeak, np.abs( lags ), np.inf ), axis=-1 )
+  peakMagnitudes = np.where( np.isfinite( peakMagnitudes ), peakMagnitudes, 0 ).astype( np.int )
+  atMagnitude = isPeak & (np.abs( lags ) == peakMagnitudes[..., np.newaxis])
+  atNegative = np.any( atMagnitude & (lags < 0), axis=-1 )
+  atPositive = np.any( atMagnitude & (lags > 0), axis=-1 )
+  peakLags = np.where( atNegative & atPositive, 0, np.where( atNegative, -peakMagnitudes, peakMagnitudes ) )
+  return peaks, peakLags
+
+# Get the peak of the correlation between the two ODFs, the lag where it occurs and the number of
+# terms it should be normalized by.  A positive lag means performer 1 is behind performer 2 by that
+# many frames, a negative lag means performer 1 is ahead.
+def getCorrelationPeak( performer1ODF, performer2ODF, **kwargs ):
+  offset = kwargs.get( 'offset', 20 )
+  method = kwargs.get( 'method', 'auto' )
+  # Pad the ODFs to the same length, and make it so that the one which is ahead is offset samples
+  # smaller than the other.  The smaller one is correlated against the larger at every lag where it
+  # fits entirely, with each ODF ahead in turn.
+  length = max( performer1ODF.shape[0], performer2ODF.shape[0] )
+  performer1ODF = padOrTruncate( performer1ODF, length )
+  performer2ODF = padOrTruncate( performer2ODF, length )
+  smallerSize = max( length - offset, 1 )
+  maxLag = performer1ODF.shape[0] - smallerSize
+  # Performer 1 ahead by k frames, and behind by k frames
+  aheadCorrelation = boundedCorrelation( performer2ODF, performer1ODF[:smallerSize], maxLag, method )
+  behindCorrelation = boundedCorrelation( performer1ODF, performer2ODF[:smallerSize], maxLag, method )
+  correlation = np.append( aheadCorrelation[:0:-1], behindCorrelation )
+  peak, lag = getPeaks( correlation, np.arange( -maxLag, maxLag + 1 ) )
+  return peak[()], int( lag ), 1.0*smallerSize
 
 def getScore( performer1ODF, performer2ODF, **kwargs ):
+  peak, lag, normalization = getCorrelationPeak( performer1ODF, performer2ODF, **kwargs )
+  # Return the max correlation, divided by the number of terms summed in it
+  return peak/normalization
+
+# Get the score for every offset in offsets from one correlation in each direction at the largest lag
+# window.  Gives the same scores as calling getScore once per offset.
+def getScores( performer1ODF, performer2ODF, offsets, **kwargs ):
+  method = kwargs.get( 'method', 'auto' )
+  length = max( performer1ODF.shape[0], performer2ODF.shape[0] )
+  performer1ODF = padOrTruncate( performer1ODF, length )
+  performer2ODF = padOrTruncate( performer2ODF, length )
+  # For each offset, the ODF which is ahead gets truncated to this size
+  smallerSizes = [max( length - offset, 1 ) for offset in offsets]
+  scores = -np.inf*np.ones( len( offsets ) )
+  # Performer 1 behind, then ahead
+  for longerODF, shorterODF in [(performer1ODF, performer2ODF), (performer2ODF, performer1ODF)]:
+    correlation = boundedCorrelation( longerODF, shorterODF, performer1ODF.shape[0] - min( smallerSizes ), method )
+    for n, smallerSize in enumerate( smallerSizes ):
+      maxLag = performer1ODF.shape[0] - smallerSize
+      # Remove the terms which fall past the end of the truncated ODF from the correlation
+      tail = boundedCorrelation( longerODF[smallerSize:], shorterODF[smallerSize:], maxLag, method )
+      scores[n] = max( scores[n], np.max( correlation[:maxLag + 1] - tail )/(1.0*smallerSize) )
+  return scores
+
+# For each onset, get the index of the nearest of the sorted target onsets (of which there must be at
+# least one).  Ties go to the earliest target.
+def getNearestOnsets( onsets, targets ):
+  after = np.clip( np.searchsorted( targets, onsets ), 0, targets.shape[0] - 1 )
+  # The first of any simultaneous targets before the onset
+  before = np.searchsorted( targets, targets[np.clip( after - 1, 0, targets.shape[0] - 1 )] )
+  return np.where( np.abs( onsets - targets[before] ) <= np.abs( targets[after] - onsets ), before, after )
+
+# Match the onsets of two performers, given as sorted arrays of onset times.  Two onsets are matched
+# when each is the other's nearest onset and they're at most maxDistance apart, so each onset is in at
+# most one match.  Returns the indices of the matched onsets in each array.
+def matchOnsets( performer1Onsets, performer2Onsets, maxDistance=np.inf ):
+  if performer1Onsets.shape[0] == 0 or performer2Onsets.shape[0] == 0:
+    return np.zeros( 0, dtype=np.int ), np.zeros( 0, dtype=np.int )
+  nearest2 = getNearestOnsets( performer1Onsets, performer2Onsets )
+  nearest1 = getNearestOnsets( performer2Onsets, performer1Onsets )
+  indices1 = np.flatnonzero( nearest1[nearest2] == np.arange( performer1Onsets.shape[0] ) )
+  indices2 = nearest2[indices1]
+  closeEnough = np.abs( performer1Onsets[indices1] - performer2Onsets[indices2] ) <= maxDistance
+  return indices1[closeEnough], indices2[closeEnough]
+
+# Get statistics of the asynchrony between two performers' matched onsets, given as sorted arrays of
+# onset times (in seconds), without any audio.  The asynchrony of a pair is performer 1's onset minus
+# performer 2's, so like the lag from getCorrelationPeak it's positive when performer 1 is behind.
+# Returns a dict of the number of matched pairs, the mean, standard deviation and mean absolute value
+# of the asynchrony, the fractions of pairs where performer 1 leads and lags, and the fraction of all
+# onsets which are in a pair within tolerance of each other.
+def getOnsetAsynchrony( performer1Onsets, performer2Onsets, **kwargs ):
+  # Onsets further apart than this aren't matched
+  maxDistance = kwargs.get( 'maxDistance', 0.25 )
+  tolerance = kwargs.get( 'tolerance', 0.05 )
+  performer1Onsets = np.asarray( performer1Onsets, dtype=np.float64 )
+  performer2Onsets = np.asarray( performer2Onsets, dtype=np.float64 )
+  indices1, indices2 = matchOnsets( performer1Onsets, performer2Onsets, maxDistance )
+  asynchrony = performer1Onsets[indices1] - performer2Onsets[indices2]
+  statistics = {'matched': asynchrony.shape[0], 'mean': np.nan, 'std': np.nan, 'meanAbsolute': np.nan, 'lead': np.nan, 'lag': np.nan}
+  if asynchrony.shape[0] > 0:
+    statistics['mean'] = np.mean( asynchrony )
+    statistics['std'] = np.std( asynchrony )
+    statistics['meanAbsolute'] = np.mean( np.abs( asynchrony ) )
+    statistics['lead'] = np.mean( asynchrony < 0 )
+    statistics['lag'] = np.mean( asynchrony > 0 )
+  nOnsets = performer1Onsets.shape[0] + performer2Onsets.shape[0]
+  statistics['withinTolerance'] = 2.0*np.sum( np.abs( asynchrony ) <= tolerance )/nOnsets if nOnsets > 0 else np.nan
+  return statistics
+
+# Render onset times (in seconds) as an impulse train at frameRate frames per second (fs/hop for an ODF
+# from a spectrogram), so that onsets can be scored with getScore like ODFs.  Each onset adds its weight
+# (default 1) to its nearest frame.  If width is given, the impulses are spread over a Hann window
+# 2*width + 1 frames wide.  The train ends at the last onset, unless length (in frames) is given.
+def onsetsToODF( onsets, frameRate, length=None, weights=None, width=0, dtype=np.float64 ):
+  frames = np.round( np.asarray( onsets, dtype=np.float64 )*frameRate ).astype( np.int )
+  if length is None:
+    length = np.max( frames ) + width + 1 if frames.shape[0] > 0 else 0
+  inRange = (frames >= 0) & (frames < length)
+  if weights is not None:
+    weights = np.asarray( weights, dtype=np.float64 )[inRange]
+  ODF = np.bincount( frames[inRange], weights=weights, minlength=length )[:length].astype( np.float64 )
+  if width > 0:
+    ODF = np.convolve( ODF, np.hanning( 2*width + 3 )[1:-1], mode='same' )
+  return ODF.astype( dtype )
+
+# Get the score and lag of every pair of a list of ODFs, for ensembles of more than two performers.
+# scores[i, j] and lags[i, j] are the score and lag getScore and getCorrelationPeak give for ODFs[i]
+# and ODFs[j], after the ODFs are padded or truncated to a common length (length, or the longest
+# ODF's), so scores is symmetric and lags[j, i] is -lags[i, j].  Each ODF is transformed once with
+# 'fft', and the correlations of every pair at all lags are computed as matrix products with 'direct';
+# 'auto' picks whichever should be faster.
+def getScoreMatrix( ODFs, **kwargs ):
   offset = kwargs.get( 'offset', 20 )
-  # Make it so that one score is 10 samples smaller than the other
-  if performer1ODF.shape[0] > performer2ODF.shape[0]:
-    performer2ODF = padOrTruncate( performer2ODF, performer1ODF.shape[0] - offset )
-    smallerSize = performer2ODF.shape[0]
+  method = kwargs.get( 'method', 'auto' )
+  length = kwargs.get( 'length', max( [ODF.shape[0] for ODF in ODFs] ) )
+  nODFs = len( ODFs )
+  ODFs = np.array( [padOrTruncate( ODF, length ) for ODF in ODFs] )
+  # Each ODF is truncated by offset, then correlated against every ODF at each lag where it fits
+  # entirely
+  smallerSize = max( length - offset, 1 )
+  maxLag = max( length - smallerSize, 0 )
+  truncatedODFs = np.array( [padOrTruncate( ODF, smallerSize ) for ODF in ODFs] )
+  fftSize = int( 2**np.ceil( np.log2( max( length, smallerSize + maxLag, 1 ) ) ) )
+  if method == 'auto':
+    # Rough operation counts, as in boundedCorrelation, for every pair
+    if (maxLag + 1)*smallerSize < 3*fftSize*np.log2( fftSize ):
+      method = 'direct'
+    else:
+      method = 'fft'
+  # correlations[i, j, k] = sum_n ODFs[j][n + k]*truncatedODFs[i][n]
+  correlations = np.zeros( (nODFs, nODFs, maxLag + 1), dtype=ODFs.dtype )
+  if method == 'direct':
+    paddedODFs = np.append( ODFs, np.zeros( (nODFs, max( smallerSize + maxLag - length, 0 )), dtype=ODFs.dtype ), axis=1 )
+    for lag in xrange( maxLag + 1 ):
+      correlations[:, :, lag] = np.dot( truncatedODFs, paddedODFs[:, lag:lag + smallerSize].T )
+  elif method == 'fft':
+    spectra = np.fft.rfft( ODFs, fftSize, axis=1 )
+    truncatedSpectra = np.conj( np.fft.rfft( truncatedODFs, fftSize, axis=1 ) )
+    # One batch of inverse transforms for each first ODF, to bound the memory used
+    for i in xrange( nODFs ):
+      correlations[i] = np.fft.irfft( truncatedSpectra[i]*spectra, fftSize, axis=1 )[:, :maxLag + 1]
   else:
-    performer1ODF = padOrTruncate( performer1ODF, performer2ODF.shape[0] - offset )
-    smallerSize = performer1ODF.shape[0]
-  # Get the correlation
-  correlation = np.correlate( performer1ODF, performer2ODF, 'valid' )
-  '''import matplotlib.pyplot as plt
-  plt.plot( performer1ODF )
-  plt.plot( performer2ODF )
-  plt.show()'''
-  # Return the max correlation, divided by the number of terms summed in it
-  return np.max( correlation )/(1.0*smallerSize)
\ No newline at end of file
+    raise ValueError( "Unknown correlation method %s" % method )
+  # As in getCorrelationPeak, ODFs[i] ahead of ODFs[j] by k frames is correlations[i, j, k], and behind
+  # is correlations[j, i, k].  Both pairs use the same sum at lag 0, so that ties are broken alike.
+  zeroLag = np.triu( correlations[:, :, 0] ) + np.triu( correlations[:, :, 0], 1 ).T
+  correlations = np.concatenate( (correlations[:, :, :0:-1], zeroLag[:, :, np.newaxis], correlations.transpose( 1, 0, 2 )[:, :, 1:]), axis=2 )
+  peaks, lags = getPeaks( correlations, np.arange( -maxLag, maxLag + 1 ) )
+  return peaks/(1.0*smallerSize), lags
+
+# Get the synchronization along two ODFs: the score and lag of the correlation in windows of windowSize
+# frames, hop frames apart (so window n starts at frame n*hop), at lags from -offset to offset.  Like
+# getCorrelationPeak, a positive lag means performer 1 is behind in that window.  The window edges
+# split the ODFs into segments, and at each lag the products are summed over every segment in one
+# pass; each window's sum is then a difference of cumulative segment sums, so the cost doesn't depend
+# on the window size or hop.
+def getLocalScores( performer1ODF, performer2ODF, windowSize, hop, **kwargs ):
+  offset = kwargs.get( 'offset', 20 )
+  dtype = np.result_type( performer1ODF.dtype, performer2ODF.dtype )
+  length = max( performer1ODF.shape[0], performer2ODF.shape[0], 1 )
+  # Sum in double precision
+  performer1ODF = padOrTruncate( performer1ODF, length ).astype( np.float64 )
+  performer2ODF = padOrTruncate( performer2ODF, length ).astype( np.float64 )
+  windowSize = min( windowSize, length )
+  windowStarts = np.arange( 0, length - windowSize + 1, hop )
+  windowEnds = windowStarts + windowSize
+  edges = np.unique( np.concatenate( ([0], windowStarts, windowEnds) ) )
+  segmentStarts = edges[edges < length]
+  startIndices = np.searchsorted( edges, windowStarts )
+  endIndices = np.searchsorted( edges, windowEnds )
+  lags = np.arange( -offset, offset + 1 )
+  correlations = np.zeros( (windowStarts.shape[0], lags.shape[0]) )
+  for n, lag in enumerate( lags ):
+    # products[i] = performer2ODF[i]*performer1ODF[i + lag]
+    products = np.zeros( length )
+    if lag >= 0 and lag < length:
+      products[:length - lag] = performer2ODF[:length - lag]*performer1ODF[lag:]
+    elif lag < 0 and -lag < length:
+      products[-lag:] = performer2ODF[-lag:]*performer1ODF[:length + lag]
+    # cumulative[m] is the sum of the products before edges[m]
+    cumulative = np.append( 0, np.cumsum( np.add.reduceat( products, segmentStarts ) ) )
+    correlations[:, n] = cumulative[endIndices] - cumulative[startIndices]
+  # Ties are broken as in getCorrelationPeak
+  peaks, peakLags = getPeaks( correlations, lags )
+  return (peaks/(1.0*windowSize)).astype( dtype ), peakLags
@@ -0,0 +1,94 @@
+# synthesizer.py
+# Render notes, given as arrays of onsets, durations, pitches and velocities, straight into a numpy
+# array, so test audio can be made without writing MIDI files and running fluidsynth on them.
+#
+# Notes are rendered a block at a time: the samples of every note in a block are laid end to end in
+# one array, computed at once, and mixed into the part of the output the block covers with bincount.
+
+import numpy as np
+import utility
+
+# Length of the additive voice's attack and release, in seconds
+attackTime = 0.01
+releaseTime = 0.05
+# Decay time constant of the percussive voice, in seconds.  Its notes last for 6 time constants.
+decayTime = 0.1
+
+# For notes with nSamples samples each, laid end to end, get the note each sample belongs to and the
+# index of the sample within its note
+def getNoteSampleIndices( nSamples ):
+  noteIndices = np.repeat( np.arange( nSamples.shape[0] ), nSamples )
+  noteStarts = np.cumsum( nSamples ) - nSamples
+  sampleIndices = np.arange( noteIndices.shape[0] ) - noteStarts[noteIndices]
+  return noteIndices, sampleIndices
+
+# Harmonic tone with a linear attack and an exponential release after the note's duration.
+# Harmonics above the Nyquist frequency are left out.  Only the fundamental is computed with sin and
+# cos; each harmonic is found from the two below it with sin(kx) = 2cos(x)sin((k-1)x) - sin((k-2)x).
+def additiveVoice( time, frequencies, durations, fs, nHarmonics=8 ):
+  phase = 2*np.pi*frequencies*time
+  twiceCosine = 2*np.cos( phase )
+  lastHarmonic = np.zeros( time.shape[0] )
+  harmonic = np.sin( phase )
+  tone = harmonic.copy()
+  for n in xrange( 2, nHarmonics + 1 ):
+    lastHarmonic, harmonic = harmonic, twiceCosine*harmonic - lastHarmonic
+    tone += (n*frequencies < fs/2.0)*harmonic/n
+  envelope = np.minimum( time/attackTime, 1.0 )*np.exp( -np.clip( time - durations, 0, np.inf )*5.0/releaseTime )
+  return envelope*tone
+
+# Struck tone with an inharmonic partial, decaying exponentially regardless of the note's duration
+def percussiveVoice( time, frequencies, durations, fs ):
+  tone = np.sin( 2*np.pi*frequencies*time ) + 0.5*(2.76*frequencies < fs/2.0)*np.sin( 2*np.pi*2.76*frequencies*time )
+  return np.exp( -time/decayTime )*tone
+
+# Number of samples each note is rendered for, with each voice
+def getNoteLengths( durations, fs, voice ):
+  if voice == 'percussive':
+    return np.ones( durations.shape[0], dtype=np.int )*int( np.ceil( 6*decayTime*fs ) )
+  return np.ceil( (durations + releaseTime)*fs ).astype( np.int )
+
+# Render notes to audio.  onsets and durations are in seconds, pitches are MIDI note numbers and
+# velocities are MIDI velocities (0-127).  voice is 'additive' or 'percussive'.  The output lasts until
+# the end of the last note, unless length (in samples) is given.  At most maxBlockSamples note samples
+# are computed at once, which bounds the size of the temporary arrays.
+def synthesize( onsets, durations, pitches, velocities, fs=44100, voice='additive', length=None, dtype=np.float64, maxBlockSamples=2**22 ):
+  if voice not in ('additive', 'percussive'):
+    raise ValueError( "Unknown voice %s" % voice )
+  # In order of onset, so that each block covers as little of the output as possible
+  order = np.argsort( np.asarray( onsets, dtype=np.float64 ), kind='mergesort' )
+  onsets = np.asarray( onsets, dtype=np.float64 )[order]
+  durations = np.asarray( durations, dtype=np.float64 )[order]
+  frequencies = utility.midiToHz( np.asarray( pitches, dtype=np.float64 )[order] )
+  amplitudes = np.asarray( velocities, dtype=np.float64 )[order]/127.0
+  startSamples = np.round( onsets*fs ).astype( np.int )
+  nSamples = getNoteLengths( durations, fs, voice )
+  if length is None:
+    length = np.max( startSamples + nSamples ) if startSamples.shape[0] > 0 else 0
+  output = np.zeros( length )
+  # Split the notes into blocks of at most maxBlockSamples samples, with at least one note in each
+  cumulativeSamples = np.cumsum( nSamples )
+  blockStart = 0
+  while blockStart < nSamples.shape[0]:
+    previousSamples = cumulativeSamples[blockStart - 1] if blockStart > 0 else 0
+    blockEnd = max( blockStart + 1, np.searchsorted( cumulativeSamples, previousSamples + maxBlockSamples, side='right' ) )
+    block = slice( blockStart, blockEnd )
+    noteIndices, sampleIndices = getNoteSampleIndices( nSamples[block] )
+    noteIndices += blockStart
+    time = sampleIndices/(1.0*fs)
+    if voice == 'percussive':
+      values = percussiveVoice( time, frequencies[noteIndices], durations[noteIndices], fs )
+    else:
+      values = additiveVoice( time, frequencies[noteIndices], durations[noteIndices], fs )
+    values *= amplitudes[noteIndices]
+    positions = startSamples[noteIndices] + sampleIndices
+    # Leave out samples outside of the output
+    inRange = (positions >= 0) & (positions < length)
+    positions = positions[inRange]
+    if positions.shape[0] > 0:
+      # Mix the block into the part of the output it covers
+      first = np.min( positions )
+      last = np.max( positions )
+      output[first:last + 1] += np.bincount( positions - first, weights=values[inRange], minlength=last - first + 1 )
+    blockStart = blockEnd
+  return output.astype( dtype, copy=False )
@@ -0,0 +1,247 @@
+# test_synchronizationScore.py
+# Checks of the synchronization scores against straightforward reference computations.
+# Run with python -m unittest test_synchronizationScore
+
+import numpy as np
+import unittest
+import synchronizationScore
+
+# ODF-like train of random impulses, with a little noise everywhere
+def getRandomODF( randomState, length, nOnsets=40 ):
+  ODF = 0.01*randomState.rand( length )
+  ODF[randomState.randint( 0, length, nOnsets )] += 1 + randomState.rand( nOnsets )
+  return ODF
+
+# Shift an ODF later by lag frames (earlier if lag is negative), keeping its length
+def shift( ODF, lag ):
+  if lag >= 0:
+    return np.append( np.zeros( lag ), ODF[:ODF.shape[0] - lag] )
+  return np.append( ODF[-lag:], np.zeros( -lag ) )
+
+class BoundedCorrelationTest( unittest.TestCase ):
+  def test_matches_numpy_correlate( self ):
+    randomState = np.random.RandomState( 0 )
+    for xLength, yLength, maxLag in [(100, 80, 20), (50, 50, 10), (30, 60, 40), (1, 1, 0), (10, 3, 15)]:
+      x = randomState.randn( xLength )
+      y = randomState.randn( yLength )
+      # correlation[k] = sum_n x[n + k]*y[n], with x zero past its end
+      padded = np.append( x, np.zeros( yLength + maxLag ) )
+      reference = np.correlate( padded, y, 'valid' )[:maxLag + 1]
+      for method in ['direct', 'fft', 'auto']:
+        correlation = synchronizationScore.boundedCorrelation( x, y, maxLag, method )
+        self.assertEqual( correlation.shape, (maxLag + 1,) )
+        self.assertTrue( np.allclose( correlation, reference ), (xLength, yLength, maxLag, method) )
+
+  def test_keeps_single_precision( self ):
+    x = np.ones( 64, dtype=np.float32 )
+    for method in ['direct', 'fft']:
+      self.assertEqual( synchronizationScore.boundedCorrelation( x, x, 8, method ).dtype, np.float32 )
+
+  def test_unknown_method( self ):
+    self.assertRaises( ValueError, synchronizationScore.boundedCorrelation, np.ones( 4 ), np.ones( 4 ), 1, 'slow' )
+
+class CorrelationPeakTest( unittest.TestCase ):
+  def test_lag_sign( self ):
+    randomState = np.random.RandomState( 1 )
+    ODF = getRandomODF( randomState, 500 )
+    for lag in [5, -5, 0, 20, -20]:
+      # performer 1 is behind by lag frames
+      performer1ODF = shift( ODF, lag )
+      for method in ['direct', 'fft']:
+        peak, peakLag, normalization = synchronizationScore.getCorrelationPeak( performer1ODF, ODF, offset=20, method=method )
+        self.assertEqual( peakLag, lag, (lag, method) )
+        self.assertEqual( normalization, 480.0 )
+        # Swapping the performers negates the lag
+        self.assertEqual( synchronizationScore.getCorrelationPeak( ODF, performer1ODF, offset=20, method=method )[1], -lag )
+
+  def test_unequal_lengths( self ):
+    randomState = np.random.RandomState( 2 )
+    ODF = getRandomODF( randomState, 400 )
+    for lag in [7, -7]:
+      performer1ODF = shift( ODF, lag )
+      # Either performer's ODF can be the longer one
+      self.assertEqual( synchronizationScore.getCorrelationPeak( np.append( performer1ODF, np.zeros( 30 ) ), ODF )[1], lag )
+      self.assertEqual( synchronizationScore.getCorrelationPeak( performer1ODF, np.append( ODF, np.zeros( 30 ) ) )[1], lag )
+
+  def test_matches_brute_force( self ):
+    randomState = np.random.RandomState( 3 )
+    for length1, length2, offset in [(200, 200, 20), (150, 190, 10), (100, 60, 5), (30, 30, 40)]:
+      performer1ODF = randomState.rand( length1 )
+      performer2ODF = randomState.rand( length2 )
+      length = max( length1, length2 )
+      padded1 = np.append( performer1ODF, np.zeros( 2*length ) )
+      padded2 = np.append( performer2ODF, np.zeros( 2*length ) )
+      smallerSize = max( length - offset, 1 )
+      maxLag = length - smallerSize
+      # The ODF which is ahead is truncated to smallerSize, and the other slides past it
+      reference = dict( (lag, np.dot( padded1[lag:lag + smallerSize], padded2[:smallerSize] )) for lag in xrange( 1, maxLag + 1 ) )
+      reference.update( (-lag, np.dot( padded2[lag:lag + smallerSize], padded1[:smallerSize] )) for lag in xrange( 0, maxLag + 1 ) )
+      referenceLag = max( reference, key=lambda lag: reference[lag] )
+      peak, lag, normalization = synchronizationScore.getCorrelationPeak( performer1ODF, performer2ODF, offset=offset )
+      self.assertEqual( lag, referenceLag )
+      self.assertAlmostEqual( peak, reference[referenceLag] )
+      self.assertEqual( normalization, smallerSize )
+
+  def test_ambiguous_peak( self ):
+    # Equally high peaks at -3 and 3 frames
+    ODF = np.zeros( 100 )
+    ODF[50] = 1
+    performer2ODF = shift( ODF, 3 ) + shift( ODF, -3 )
+    peak, lag, normalization = synchronizationScore.getCorrelationPeak( ODF, performer2ODF, offset=10 )
+    self.assertEqual( lag, 0 )
+    self.assertEqual( peak, 1 )
+
+  def test_scores_match_score( self ):
+    randomState = np.random.RandomState( 4 )
+    offsets = [2, 10, 20, 50]
+    for length1, length2 in [(300, 300), (250, 300), (300, 240), (20, 20)]:
+      performer1ODF = getRandomODF( randomState, length1 )
+      performer2ODF = shift( getRandomODF( randomState, length2 ), 4 )
+      scores = synchronizationScore.getScores( performer1ODF, performer2ODF, offsets )
+      reference = [synchronizationScore.getScore( performer1ODF, performer2ODF, offset=offset ) for offset in offsets]
+      self.assertTrue( np.allclose( scores, reference ), (length1, length2) )
+
+class OnsetMatchingTest( unittest.TestCase ):
+  def test_empty( self ):
+    empty = np.zeros( 0 )
+    for performer1Onsets, performer2Onsets in [(empty, empty), (empty, np.array( [1.0] )), (np.array( [1.0, 2.0] ), empty)]:
+      indices1, indices2 = synchronizationScore.matchOnsets( performer1Onsets, performer2Onsets )
+      self.assertEqual( (indices1.shape[0], indices2.shape[0]), (0, 0) )
+      statistics = synchronizationScore.getOnsetAsynchrony( performer1Onsets, performer2Onsets )
+      self.assertEqual( statistics['matched'], 0 )
+      self.assertTrue( np.isnan( statistics['mean'] ) )
+    self.assertTrue( np.isnan( synchronizationScore.getOnsetAsynchrony( [], [] )['withinTolerance'] ) )
+    self.assertEqual( synchronizationScore.getOnsetAsynchrony( [], [1.0] )['withinTolerance'], 0 )
+
+  def test_ties( self ):
+    # An onset halfway between two others is matched with the earlier one
+    indices1, indices2 = synchronizationScore.matchOnsets( np.array( [1.0] ), np.array( [0.5, 1.5] ) )
+    self.assertEqual( (list( indices1 ), list( indices2 )), ([0], [0]) )
+    indices1, indices2 = synchronizationScore.matchOnsets( np.array( [0.5, 1.5] ), np.array( [1.0] ) )
+    self.assertEqual( (list( indices1 ), list( indices2 )), ([0], [0]) )
+    # Simultaneous onsets are each matched at most once
+    indices1, indices2 = synchronizationScore.matchOnsets( np.array( [1.0, 1.0] ), np.array( [1.0] ) )
+    self.assertEqual( (list( indices1 ), list( indices2 )), ([0], [0]) )
+    indices1, indices2 = synchronizationScore.matchOnsets( np.array( [2.0] ), np.array( [1.0, 1.0] ) )
+    self.assertEqual( (list( indices1 ), list( indices2 )), ([0], [0]) )
+
+  def test_unmatched( self ):
+    performer1Onsets = np.array( [0.0, 1.03, 2.0, 3.5] )
+    performer2Onsets = np.array( [0.01, 1.0, 2.2, 10.0] )
+    # 3.5's nearest onset is 2.2, whose nearest is 2.0, and 10.0 is too far from anything
+    indices1, indices2 = synchronizationScore.matchOnsets( performer1Onsets, performer2Onsets, 0.25 )
+    self.assertEqual( (list( indices1 ), list( indices2 )), ([0, 1, 2], [0, 1, 2]) )
+    indices1, indices2 = synchronizationScore.matchOnsets( performer1Onsets, performer2Onsets, 0.1 )
+    self.assertEqual( (list( indices1 ), list( indices2 )), ([0, 1], [0, 1]) )
+    statistics = synchronizationScore.getOnsetAsynchrony( performer1Onsets, performer2Onsets, maxDistance=0.25, tolerance=0.05 )
+    asynchrony = np.array( [-0.01, 0.03, -0.2] )
+    self.assertEqual( statistics['matched'], 3 )
+    self.assertAlmostEqual( statistics['mean'], np.mean( asynchrony ) )
+    self.assertAlmostEqual( statistics['std'], np.std( asynchrony ) )
+    self.assertAlmostEqual( statistics['meanAbsolute'], np.mean( np.abs( asynchrony ) ) )
+    self.assertAlmostEqual( statistics['lead'], 2/3.0 )
+    self.assertAlmostEqual( statistics['lag'], 1/3.0 )
+    # Two pairs within tolerance, out of eight onsets
+    self.assertAlmostEqual( statistics['withinTolerance'], 0.5 )
+
+  def test_matches_brute_force( self ):
+    randomState = np.random.RandomState( 7 )
+    for n in xrange( 50 ):
+      # On a coarse grid, so that there are plenty of ties
+      performer1Onsets = np.sort( randomState.randint( 0, 40, randomState.randint( 1, 15 ) ) )/4.0
+      performer2Onsets = np.sort( randomState.randint( 0, 40, randomState.randint( 1, 15 ) ) )/4.0
+      maxDistance = randomState.choice( [0.25, 1.0, np.inf] )
+      nearest2 = [np.argmin( np.abs( performer2Onsets - onset ) ) for onset in performer1Onsets]
+      nearest1 = [np.argmin( np.abs( performer1Onsets - onset ) ) for onset in performer2Onsets]
+      reference = [(i, j) for i, j in enumerate( nearest2 ) if nearest1[j] == i and abs( performer1Onsets[i] - performer2Onsets[j] ) <= maxDistance]
+      indices1, indices2 = synchronizationScore.matchOnsets( performer1Onsets, performer2Onsets, maxDistance )
+      self.assertEqual( zip( indices1, indices2 ), reference )
+
+  def test_onsets_to_ODF( self ):
+    ODF = synchronizationScore.onsetsToODF( [0.0, 0.1, 0.1, 0.52], 10 )
+    self.assertTrue( np.all( ODF == [1, 2, 0, 0, 0, 1] ) )
+    ODF = synchronizationScore.onsetsToODF( [0.1, 0.3, 5.0], 10, length=4, weights=[0.5, 2, 7] )
+    self.assertTrue( np.all( ODF == [0, 0.5, 0, 2] ) )
+    # Spread over 2*width + 1 frames, peaking at the onset
+    ODF = synchronizationScore.onsetsToODF( [1.0], 10, width=3 )
+    self.assertEqual( ODF.shape[0], 14 )
+    self.assertEqual( np.argmax( ODF ), 10 )
+    self.assertTrue( np.all( (ODF > 0) == (np.abs( np.arange( 14 ) - 10 ) <= 3) ) )
+    self.assertEqual( synchronizationScore.onsetsToODF( [], 10 ).shape[0], 0 )
+
+class ScoreMatrixTest( unittest.TestCase ):
+  def test_matches_correlation_peak( self ):
+    randomState = np.random.RandomState( 5 )
+    ODF = getRandomODF( randomState, 300 )
+    ODFs = [shift( ODF, lag ) + 0.1*getRandomODF( randomState, 300 ) for lag in [0, 6, -4, 11, 6]]
+    for method in ['direct', 'fft']:
+      scores, lags = synchronizationScore.getScoreMatrix( ODFs, offset=20, method=method )
+      for i in xrange( len( ODFs ) ):
+        for j in xrange( len( ODFs ) ):
+          peak, lag, normalization = synchronizationScore.getCorrelationPeak( ODFs[i], ODFs[j], offset=20, method=method )
+          self.assertEqual( lags[i, j], lag, (i, j, method) )
+          self.assertAlmostEqual( scores[i, j], peak/normalization )
+
+  def test_antisymmetric_lags( self ):
+    randomState = np.random.RandomState( 6 )
+    ODF = getRandomODF( randomState, 200 )
+    # Including identical ODFs, whose peaks are tied at lag 0
+    ODFs = [shift( ODF, lag ) for lag in [0, 3, -8, 3, 15]] + [getRandomODF( randomState, 150 )]
+    for method in ['direct', 'fft']:
+      scores, lags = synchronizationScore.getScoreMatrix( ODFs, offset=20, method=method )
+      self.assertTrue( np.all( lags == -lags.T ) )
+      self.assertTrue( np.all( scores == scores.T ) )
+      self.assertEqual( lags[1, 2], 11 )
+      self.assertEqual( lags[1, 3], 0 )
+
+class LocalScoresTest( unittest.TestCase ):
+  # Score and lag of each window, one sum at a time
+  def getReference( self, performer1ODF, performer2ODF, windowSize, hop, offset ):
+    length = max( performer1ODF.shape[0], performer2ODF.shape[0], 1 )
+    performer1ODF = synchronizationScore.padOrTruncate( performer1ODF, length )
+    performer2ODF = synchronizationScore.padOrTruncate( performer2ODF, length )
+    windowSize = min( windowSize, length )
+    scores = []
+    lags = []
+    for start in xrange( 0, length - windowSize + 1, hop ):
+      correlation = {}
+      for lag in xrange( -offset, offset + 1 ):
+        correlation[lag] = sum( [performer2ODF[n]*performer1ODF[n + lag] for n in xrange( start, start + windowSize ) if 0 <= n + lag < length] )
+      peak = max( correlation.values() )
+      peakLags = [lag for lag in correlation if correlation[lag] == peak]
+      magnitude = min( [abs( lag ) for lag in peakLags] )
+      # Ambiguous between a lag and its negation
+      if magnitude in peakLags and -magnitude in peakLags:
+        lags.append( 0 )
+      else:
+        lags.append( magnitude if magnitude in peakLags else -magnitude )
+      scores.append( peak/(1.0*windowSize) )
+    return np.array( scores ), np.array( lags )
+
+  def test_matches_brute_force( self ):
+    randomState = np.random.RandomState( 8 )
+    # Hops which do and don't divide the ODF, windows longer than the ODFs, unequal lengths, no lag and
+    # lags longer than the ODFs
+    for length1, length2, windowSize, hop, offset in [(300, 300, 50, 10, 5), (300, 300, 50, 7, 5), (200, 250, 64, 7, 3), (250, 200, 64, 64, 3), (40, 40, 100, 5, 8), (100, 90, 30, 30, 0), (20, 25, 10, 3, 30)]:
+      ODF = getRandomODF( randomState, max( length1, length2 ) + 10, 20 )
+      performer1ODF = ODF[4:4 + length1]
+      performer2ODF = ODF[:length2]
+      scores, lags = synchronizationScore.getLocalScores( performer1ODF, performer2ODF, windowSize, hop, offset=offset )
+      referenceScores, referenceLags = self.getReference( performer1ODF, performer2ODF, windowSize, hop, offset )
+      self.assertEqual( scores.shape, referenceScores.shape )
+      self.assertTrue( np.allclose( scores, referenceScores ), (length1, length2, windowSize, hop, offset) )
+      self.assertTrue( np.all( lags == referenceLags ), (length1, length2, windowSize, hop, offset) )
+
+  def test_ties( self ):
+    # Silence is tied at every lag
+    scores, lags = synchronizationScore.getLocalScores( np.zeros( 50, dtype=np.float32 ), np.zeros( 50, dtype=np.float32 ), 10, 10 )
+    self.assertEqual( scores.dtype, np.float32 )
+    self.assertTrue( np.all( scores == 0 ) and np.all( lags == 0 ) )
+    # Equally high peaks at -3 and 3 frames in the first window, as in getCorrelationPeak
+    ODF = np.zeros( 100 )
+    ODF[20] = 1
+    performer2ODF = shift( ODF, 3 ) + shift( ODF, -3 )
+    self.assertEqual( synchronizationScore.getLocalScores( ODF, performer2ODF, 50, 50, offset=10 )[1][0], synchronizationScore.getCorrelationPeak( ODF, performer2ODF, offset=10 )[1] )
+
+if __name__ == "__main__":
+  unittest.main()
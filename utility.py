@@ -10,8 +10,12 @@ import os
 import struct
 import mad
 import scipy.io.wavfile as wavfile
+import scipy.signal
+import scipy.fftpack
+import cache
 
-def getWavData( wavFile ):
+# dtype sets the precision of the returned samples, np.float64 or np.float32
+def getWavData( wavFile, normalize=True, dtype=np.float64 ):
   '''# Get wav data
   wav = wave.open (wavFile, "r")
   (nChannels, sampleWidth, frameRate, nFrames, compressionType, compressionName) = wav.getparams()
@@ -34,52 +38,89 @@ def getWavData( wavFile ):
   fs, audioData = wavfile.read(wavFile)
   # Convert to mono
   if (len(audioData.shape) > 1) and (audioData.shape[1] > 1):
-    audioData = np.mean( audioData, axis=1 )
+    audioData = np.mean( audioData, axis=1, dtype=dtype )
   # Normalize
-  audioData = (32767.0*audioData)/np.max(np.abs(audioData))
+  if normalize:
+    audioData = (np.dtype( dtype ).type( 32767.0 )*audioData)/np.max(np.abs(audioData))
+  else:
+    audioData = np.asarray( audioData, dtype=dtype )
   return audioData, fs
 
-def getMp3Data( mp3File ):
+# Mix a block of samples down to mono
+def mixToMono( audioData, dtype=np.float64 ):
+  if (len(audioData.shape) > 1) and (audioData.shape[1] > 1):
+    return np.mean( audioData, axis=1, dtype=dtype )
+  return np.asarray( audioData, dtype=dtype )
+
+# Iterate over blocks of a (possibly memory-mapped) signal, mixed to mono.
+# When peak is given, blocks are normalized by it as in getWavData.
+def iterateBlocks( audioData, blockSize, peak=None, dtype=np.float64 ):
+  for start in xrange( 0, audioData.shape[0], blockSize ):
+    block = mixToMono( audioData[start:start + blockSize], dtype )
+    if peak is not None:
+      block = (np.dtype( dtype ).type( 32767.0 )*block)/peak
+    yield block
+
+# Open a wav file for streaming.  The file is memory-mapped rather than read in, so memory use is
+# bounded by blockSize rather than the length of the file.  When normalize is set, a first pass over
+# the file finds its peak so that blocks are scaled the same way getWavData scales the whole signal.
+# Returns an iterator over mono blocks, the sampling rate and the number of samples.
+def getWavStream( wavFile, blockSize=2**16, normalize=True, dtype=np.float64 ):
+  fs, audioData = wavfile.read( wavFile, mmap=True )
+  peak = None
+  if normalize:
+    peak = 0
+    for block in iterateBlocks( audioData, blockSize, dtype=dtype ):
+      peak = max( peak, np.max( np.abs( block ) ) )
+  return iterateBlocks( audioData, blockSize, peak, dtype ), fs, audioData.shape[0]
+
+def getMp3Data( mp3File, dtype=np.float64 ):
   # Prepare mp3 file object
   mf = mad.MadFile(mp3File)
-  # Get PCM data
+  # Get PCM data, mixed to mono
   audioData = mp3ToPCM( mf )
-  # Convert to mono
-  audioData = (audioData[::2] + audioData[1::2])/2.0
   # Store fs
   fs = mf.samplerate()
   # Normalize
   audioData = audioData/np.max(np.abs(audioData))
-  return audioData, fs
+  return audioData.astype( dtype, copy=False ), fs
 
+# Iterate over the decoded buffers of an mp3 file, mixed to mono as they're decoded.
+# pymad always decodes to interleaved 16 bit stereo.
+def iterateMp3Blocks( mf ):
+  buffy = mf.read()
+  while buffy is not None:
+    # Convenient, fast function!  Reads in 16 bit values from the buffer
+    buffy = np.frombuffer( buffy, 'h' )
+    yield (buffy[::2] + np.asarray( buffy[1::2], dtype=np.float64 ))/2.0
+    buffy = mf.read()
+
+# Open an mp3 file for streaming.  Returns an iterator over unnormalized mono blocks, which can be
+# passed to getStreamingSpectrogramBlocks, and the sampling rate.
+def getMp3Stream( mp3File ):
+  mf = mad.MadFile(mp3File)
+  return iterateMp3Blocks( mf ), mf.samplerate()
+
+# Decode an mp3 file to mono PCM
 def mp3ToPCM( mf ):
   # Get sample rate
   fs = mf.samplerate()
-  # Initialize audioData array.  total_time is in milliseconds and rounded (eg 49000)
-  # and there are two channels, so to get samples, add 1 second and multiply by 2
-  audioData = np.zeros((mf.total_time()/1000)*2*fs)
+  # Initialize audioData array.  total_time is in milliseconds and rounded, so add 1 second.
+  audioData = np.zeros( int( (mf.total_time()/1000.0 + 1)*fs ) )
   # Where in audioData are we?
-  dataPointer = 0;
-  # Read in the first buffer to get the length
-  buffy = mf.read();
-  # Length in per-channel samples
-  buffyLen = len(buffy)/2
-  # Read through file
-  while 1:
-    # Reached the end
-    if buffy is None:
-      break
-    if dataPointer + buffyLen > audioData.shape[0]:
-      break
-    # Convenient, fast function!  Reads in 16 bit values from the buffer
-    buffy = np.frombuffer(buffy, 'h')
+  dataPointer = 0
+  for block in iterateMp3Blocks( mf ):
+    # If the length estimate was too short, grow the array rather than dropping data
+    if dataPointer + block.shape[0] > audioData.shape[0]:
+      grownAudioData = np.zeros( max( 2*audioData.shape[0], dataPointer + block.shape[0] ) )
+      grownAudioData[:dataPointer] = audioData[:dataPointer]
+      audioData = grownAudioData
     # Store this buffer in the audioData
-    audioData[dataPointer:(dataPointer+buffyLen)] = buffy
+    audioData[dataPointer:(dataPointer + block.shape[0])] = block
     # Incrememt data pointer
-    dataPointer = dataPointer + buffyLen
-    # Read next buffer
-    buffy = mf.read();
-  return audioData
+    dataPointer = dataPointer + block.shape[0]
+  # Trim to the decoded length
+  return audioData[:dataPointer]
 
 def writeWav( audioData, fs, filename, normalize = 1 ):
   if normalize:
@@ -87,17 +128,42 @@ def writeWav( audioData, fs, filename, normalize = 1 ):
   audioData = np.array( audioData*32767, dtype=np.int16 )
   wavfile.write( filename, fs, audioData )
 
-# Wrapper for all audio file types
-def getAudioData( audioFile ):
+# Wrapper for all audio file types, which uses the cache when it's enabled.
+# dtype sets the precision of the returned samples, np.float64 or np.float32
+def getAudioData( audioFile, dtype=np.float64 ):
   # Check that the file exists
   if not os.path.exists( audioFile ):
     print "%s doesn't exist." % audioFile
     return np.array([]), 0
+  if not cache.isEnabled():
+    return readAudioData( audioFile, dtype )
+  audioKey = getAudioCacheKey( audioFile, dtype )
+  fsKey = cache.getKey( 'fs', cache.fileHash( audioFile ) )
+  audioData = cache.load( audioKey )
+  fs = cache.load( fsKey )
+  if audioData is not None and fs is not None:
+    return audioData, int( fs[0] )
+  audioData, fs = readAudioData( audioFile, dtype )
+  # Don't cache files which couldn't be read
+  if fs > 0:
+    cache.store( audioKey, audioData )
+    cache.store( fsKey, np.array( [fs] ) )
+  return audioData, fs
+
+# Cache key of the audio getAudioData reads from a file, which the keys of the results computed from
+# it are chained from, or None when caching is disabled.  The file is only hashed once.
+def getAudioCacheKey( audioFile, dtype=np.float64 ):
+  if not cache.isEnabled() or not os.path.exists( audioFile ):
+    return None
+  return cache.getKey( 'audio', cache.fileHash( audioFile ), np.dtype( dtype ).name )
+
+# Read in audio data based on the file's extension
+def readAudioData( audioFile, dtype=np.float64 ):
   basename, extension = os.path.splitext( audioFile )
   if extension == '.mp3':
-    return getMp3Data( audioFile )
+    return getMp3Data( audioFile, dtype )
   elif extension == '.wav':
-    return getWavData( audioFile )
+    return getWavData( audioFile, dtype=dtype )
   else:
     print "%s is not a .wav or .mp3." % audioFile
     return np.array([]), 0
@@ -112,29 +178,117 @@ def getFiles( path, extension ):
         fileList.append(os.path.join(root, file))
   return fileList
 
-# Split a signal into frames
+# Split a signal into frames.  The frames are a strided view onto data, so no samples are
+# copied - don't write to the result.
 def splitSignal( data, hop, frameSize ):
-  nFrames = np.floor( (data.shape[0] - frameSize)/(1.0*hop) )
-  # Pre-allocate matrix
-  dataSplit = np.zeros( (nFrames, frameSize) )
-  for n in np.arange(nFrames):
-    dataSplit[n] = data[n*hop:n*hop+frameSize]
-  return dataSplit
+  nFrames = int( np.floor( (data.shape[0] - frameSize)/(1.0*hop) ) )
+  if nFrames < 1:
+    return np.zeros( (0, frameSize), dtype=data.dtype )
+  return np.lib.stride_tricks.as_strided( data, shape=(nFrames, frameSize), strides=(hop*data.strides[0], data.strides[0]) )
+
+# Real FFT of each row of a single precision array, computed in single precision.  numpy's FFT
+# always works in double precision, so this uses FFTPACK's single precision transform and unpacks
+# its [y(0), Re(y(1)), Im(y(1)), ...] output into complex64.
+def singlePrecisionRFFT( frames ):
+  packed = scipy.fftpack.rfft( frames, axis=1 )
+  spectra = np.zeros( (frames.shape[0], frames.shape[1]/2 + 1), dtype=np.complex64 )
+  spectra.real[:, 0] = packed[:, 0]
+  spectra.real[:, 1:] = packed[:, 1::2]
+  spectra.imag[:, 1:1 + packed[:, 2::2].shape[1]] = packed[:, 2::2]
+  return spectra
+
+# Complex type of the spectra of a signal of the given type - single precision signals get single
+# precision spectra
+def getSpectrumType( dtype ):
+  if np.dtype( dtype ) == np.float32:
+    return np.complex64
+  return np.complex
+
+# Get the spectrogram of a signal one block of frames at a time.
+# Each block is windowed and transformed in a single batched FFT call.
+def getSpectrogramBlocks( data, hop, frameSize, window, blockSize ):
+  dataSplit = splitSignal( data, hop, frameSize )
+  if data.dtype == np.float32:
+    window = np.asarray( window, dtype=np.float32 )
+  for start in xrange( 0, dataSplit.shape[0], blockSize ):
+    if data.dtype == np.float32:
+      yield singlePrecisionRFFT( window*dataSplit[start:start + blockSize] )
+    else:
+      yield np.fft.rfft( window*dataSplit[start:start + blockSize], axis=1 )
+
+# Get the spectrogram of a signal which arrives in blocks, only holding on to the samples needed
+# for frames which haven't been computed yet.  Yields blocks of spectra, giving the same frames as
+# getSpectrogram would for the whole signal.
+def getStreamingSpectrogramBlocks( blocks, hop, frameSize, window, blockSize=None ):
+  if blockSize is None:
+    blockSize = max( 1, 2**18/frameSize )
+  buffer = None
+  for block in blocks:
+    if buffer is None:
+      buffer = block
+    else:
+      buffer = np.append( buffer, block )
+    # Number of frames getSpectrogram would compute from the signal so far
+    nFrames = splitSignal( buffer, hop, frameSize ).shape[0]
+    for spectrogramBlock in getSpectrogramBlocks( buffer, hop, frameSize, window, blockSize ):
+      yield spectrogramBlock
+    # Drop the samples before the next frame
+    buffer = buffer[nFrames*hop:]
+
+# Get the spectrogram of a wav file by streaming it, so that memory use is bounded by the block size
+# and the size of the spectrogram, not the length of the file
+def getWavSpectrogram( wavFile, **kwargs ):
+  hop = kwargs.get('hop', 512)
+  frameSize = kwargs.get('frameSize', 1024)
+  window = kwargs.get('window', np.hanning(frameSize))
+  dtype = kwargs.get('dtype', np.float64)
+  blocks, fs, nSamples = getWavStream( wavFile, kwargs.get('blockSize', 2**16), kwargs.get('normalize', True), dtype )
+  # Create spectrogram array
+  spectrogram = np.zeros( (max( 0, int( np.floor( (nSamples - frameSize)/(1.0*hop) ) ) ), frameSize/2 + 1), dtype = getSpectrumType( dtype ) )
+  start = 0
+  for spectrogramBlock in getStreamingSpectrogramBlocks( blocks, hop, frameSize, window ):
+    spectrogram[start:start + spectrogramBlock.shape[0]] = spectrogramBlock
+    start += spectrogramBlock.shape[0]
+  return spectrogram, fs
 
-# Get spectrogram of signal
+# Get spectrogram of signal, which uses the cache when it's enabled and the signal's cache key is given
+# as cacheKey
 def getSpectrogram( data, **kwargs ):
   hop = kwargs.get('hop', 512)
   frameSize = kwargs.get('frameSize', 1024)
   window = kwargs.get('window', np.hanning(frameSize))
-  # Framify the signal
-  dataSplit = splitSignal( data, hop, frameSize )
+  # Number of frames transformed at once - bounds the size of the temporary arrays
+  blockSize = kwargs.get('blockSize', max( 1, 2**18/frameSize ))
+  return cache.cachedByKey( lambda: computeSpectrogram( data, hop, frameSize, window, blockSize ), getSpectrogramCacheKey( kwargs.get( 'cacheKey' ), hop, frameSize, window ) )
+
+# Cache key of a spectrogram, given the cache key of its signal
+def getSpectrogramCacheKey( cacheKey, hop, frameSize, window ):
+  # Don't hash the window unless it's needed
+  if cacheKey is None:
+    return None
+  return cache.getChildKey( 'spectrogram', cacheKey, hop, frameSize, cache.arrayHash( window ) )
+
+def computeSpectrogram( data, hop, frameSize, window, blockSize ):
+  # Number of frames in the signal
+  nFrames = splitSignal( data, hop, frameSize ).shape[0]
   # Create spectrogram array
-  spectrogram = np.zeros( (dataSplit.shape[0], dataSplit.shape[1]/2 + 1), dtype = np.complex )
+  spectrogram = np.zeros( (nFrames, frameSize/2 + 1), dtype = getSpectrumType( data.dtype ) )
   # Get spectra
-  for n in np.arange( dataSplit.shape[0] ):
-    spectrogram[n] = np.fft.rfft( window*dataSplit[n] )
+  start = 0
+  for spectrogramBlock in getSpectrogramBlocks( data, hop, frameSize, window, blockSize ):
+    spectrogram[start:start + spectrogramBlock.shape[0]] = spectrogramBlock
+    start += spectrogramBlock.shape[0]
   return spectrogram
 
+# Decimate a signal by an integer factor, keeping its precision, which uses the cache when it's enabled
+# and the signal's cache key is given
+def downsample( data, downsamplingFactor, cacheKey=None ):
+  return cache.cachedByKey( lambda: scipy.signal.decimate( data, downsamplingFactor ).astype( data.dtype, copy=False ), getDownsampledCacheKey( cacheKey, downsamplingFactor ) )
+
+# Cache key of a decimated signal, given the cache key of the signal
+def getDownsampledCacheKey( cacheKey, downsamplingFactor ):
+  return cache.getChildKey( 'decimated', cacheKey, downsamplingFactor )
+
 # Plot the magnitude and phase of a spectrogram
 def plotSpectrogram( spectrogram ):
   import matplotlib.pyplot as plt